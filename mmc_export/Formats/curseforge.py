@@ -1,5 +1,6 @@
-from pathlib import Path
+from pathlib import Path, PurePosixPath
 
+from ..Helpers.archive import ArchiveWriter
 from ..Helpers.structures import File, Intermediate, Resource, Writer
 from ..Helpers.utils import get_name_from_scheme
 
@@ -30,16 +31,8 @@ class CurseForge(Writer):
         else: self.add_override(resource.file)
 
     def add_override(self, file: File) -> None:
-
-        overrides_dir = self.temp_dir / "overrides"
-        overrides_dir.mkdir(parents=True, exist_ok=True)
-
-        file_path = overrides_dir / file.relativePath
-        file_path.mkdir(parents=True, exist_ok=True)
-        if file.disabled: file_path = file_path / (file.name + ".disabled")
-
-        from shutil import copy2 as copy_file
-        copy_file(file.path, file_path)
+        file_path = PurePosixPath("overrides", file.relativePath, file.name + ".disabled" if file.disabled else file.name)
+        self.archive.write_file(file_path.as_posix(), file.path)
 
     def write_manifest(self) -> None:
 
@@ -69,21 +62,18 @@ class CurseForge(Writer):
 
         self.write_manifest()
 
-        for resource in self.intermediate.resources:
-            self.add_resource(resource)
+        name = get_name_from_scheme("CF", "CurseForge", self.intermediate)
+        with ArchiveWriter(self.modpack_path / f"{name}.zip") as self.archive:
 
-        for override in self.intermediate.overrides:
-            self.add_override(override)
+            for resource in self.intermediate.resources:
+                self.add_resource(resource)
 
-        from json import dump as write_json
-        with open(self.temp_dir / "manifest.json", 'w') as file:
-            write_json(self.manifest, file, indent=4)
+            for override in self.intermediate.overrides:
+                self.add_override(override)
+
+            from json import dumps as encode_json
+            self.archive.write_text("manifest.json", encode_json(self.manifest, indent=4))
 
-        with open(self.temp_dir / "modlist.html", 'w', encoding="utf-8") as file:
             self.modlist.insert(0, "<ul>\n")
             self.modlist.append("</ul>\n")
-            file.writelines(self.modlist)
-
-        from shutil import make_archive
-        name = get_name_from_scheme("CF", "CurseForge", self.intermediate)
-        make_archive((self.modpack_path / name).as_posix(), 'zip', self.temp_dir, '.')
+            self.archive.write_text("modlist.html", "".join(self.modlist))
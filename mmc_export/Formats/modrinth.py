@@ -1,5 +1,6 @@
-from pathlib import Path
+from pathlib import Path, PurePosixPath
 
+from ..Helpers.archive import ArchiveWriter
 from ..Helpers.structures import File, Intermediate, Resource, Writer
 from ..Helpers.utils import get_name_from_scheme
 
@@ -28,16 +29,8 @@ class Modrinth(Writer):
         self.index['files'].append(data)
 
     def add_override(self, file: File) -> None:
-
-        overrides_dir = self.temp_dir / "overrides"
-        overrides_dir.mkdir(parents=True, exist_ok=True)
-
-        file_path = overrides_dir / file.relativePath
-        file_path.mkdir(parents=True, exist_ok=True)
-        if file.disabled: file_path = file_path / (file.name + ".disabled")
-
-        from shutil import copy2 as copy_file
-        copy_file(file.path, file_path)
+        file_path = PurePosixPath("overrides", file.relativePath, file.name + ".disabled" if file.disabled else file.name)
+        self.archive.write_file(file_path.as_posix(), file.path)
 
     def write_index(self) -> None:
         
@@ -92,29 +85,25 @@ class Modrinth(Writer):
 
         self.write_index()
 
-        for override in self.intermediate.overrides:
-            self.add_override(override)
+        name = get_name_from_scheme("MR", "Modrinth", self.intermediate)
+        with ArchiveWriter(self.modpack_path / f"{name}.mrpack") as self.archive:
 
-        bundled_files: list[Resource] = list()
-        from copy import deepcopy as copy_object
+            for override in self.intermediate.overrides:
+                self.add_override(override)
 
-        for resource in self.intermediate.resources:
-            resource_copy = copy_object(resource)
-            resource_copy.providers.pop('CurseForge', None)
+            bundled_files: list[Resource] = list()
+            from copy import deepcopy as copy_object
 
-            if not resource_copy.providers:
-                self.add_override(resource.file)
-                bundled_files.append(resource)
-            else: self.add_resource(resource_copy)
+            for resource in self.intermediate.resources:
+                resource_copy = copy_object(resource)
+                resource_copy.providers.pop('CurseForge', None)
 
-        self.print_bundled(bundled_files)
+                if not resource_copy.providers:
+                    self.add_override(resource.file)
+                    bundled_files.append(resource)
+                else: self.add_resource(resource_copy)
 
-        from json import dump as write_json
-        with open(self.temp_dir / "modrinth.index.json", 'w') as file:
-            write_json(self.index, file, indent=4)
+            self.print_bundled(bundled_files)
 
-        from shutil import make_archive
-        name = get_name_from_scheme("MR", "Modrinth", self.intermediate)
-        archive_path = self.modpack_path.joinpath("__tmp__." + name).as_posix()
-        archive = Path(make_archive(archive_path, 'zip', self.temp_dir, '.'))
-        archive.replace(archive.with_name(name + ".mrpack"))
+            from json import dumps as encode_json
+            self.archive.write_text("modrinth.index.json", encode_json(self.index, indent=4))
@@ -1,9 +1,9 @@
 from contextlib import suppress
-from pathlib import Path
+from pathlib import Path, PurePosixPath
 
-from tomli_w import dump as write_toml
 from tomli_w import dumps as encode_toml
 
+from ..Helpers.archive import ArchiveWriter, DirectoryWriter
 from ..Helpers.structures import File, Intermediate, Resource, Writer
 from ..Helpers.utils import get_hash, get_name_from_scheme
 from .. import config
@@ -91,23 +91,21 @@ class packwiz(Writer):
         from werkzeug.utils import secure_filename
         if not slug: slug = secure_filename(resource.name)
 
-        toml_path = self.temp_dir / resource.file.relativePath / (slug + ".pw.toml")
-        toml_path.parent.mkdir(parents=True, exist_ok=True)
+        toml_path = PurePosixPath(resource.file.relativePath, slug + ".pw.toml")
 
-        with open(toml_path, "w", encoding="utf-8") as file:
+        if not data['update']: del data['update']
+        toml_data = encode_toml(data)
 
-            if not data['update']: del data['update']
-            toml_data = encode_toml(data)
+        with suppress(ValueError):
+            index = toml_data.index("[update")
+            toml_data = toml_data[:index] + "[update]\n" + toml_data[index:]
 
-            with suppress(ValueError):
-                index = toml_data.index("[update")
-                toml_data = toml_data[:index] + "[update]\n" + toml_data[index:]
-
-            file.write(toml_data)
+        toml_bytes = toml_data.encode("utf-8")
+        self.archive.write_text(toml_path.as_posix(), toml_bytes)
 
         index_data = {
-            "file": toml_path.relative_to(self.temp_dir).as_posix(),
-            "hash": get_hash(toml_path),
+            "file": toml_path.as_posix(),
+            "hash": get_hash(toml_bytes),
             "metafile": True
         }
         
@@ -115,53 +113,64 @@ class packwiz(Writer):
 
     def add_override(self, file: File) -> None:
 
-        file_path = self.temp_dir / file.relativePath
-        file_path.mkdir(parents=True, exist_ok=True)
-        if file.disabled: file_path = file_path / (file.name + ".disabled")
-
-        from shutil import copy2 as copy_file
-        copy_file(file.path, file_path)
+        file_path = PurePosixPath(file.relativePath, file.name + ".disabled" if file.disabled else file.name)
+        self.archive.write_file(file_path.as_posix(), file.path, file.hash.sha256)
 
         data = {
-            "file": Path(file.relativePath).joinpath(file.name).as_posix(),
+            "file": file_path.as_posix(),
             "hash": file.hash.sha256
         }
         
         self.index['files'].append(data)
 
+    @staticmethod
+    def read_index(directory: Path) -> dict[str, str]:
+
+        "Files listed by the index of an existing packwiz directory, with their hashes"
+
+        from tomllib import loads as parse_toml
+
+        index_path = directory / "index.toml"
+        if not index_path.is_file(): return dict()
+
+        index = parse_toml(index_path.read_text("utf-8"))
+        return {entry['file']: entry['hash'] for entry in index.get('files', [])}
+
     def write(self) -> None:
 
-        for override in self.intermediate.overrides:
-            self.add_override(override)
+        if directory := config.packwiz_directory:
+            output = DirectoryWriter(directory, self.read_index(directory))
+        else:
+            name = get_name_from_scheme("PW", "Packwiz", self.intermediate)
+            output = ArchiveWriter(self.modpack_path / f"{name}.zip")
 
-        for resource in self.intermediate.resources:
-            self.add_resource(resource)
+        with output as self.archive:
 
-        index_path = self.temp_dir / "index.toml"
-        with open(index_path, "wb") as file:
-            write_toml(self.index, file)
+            for override in self.intermediate.overrides:
+                self.add_override(override)
 
-        self.pack_info = {
-            "name": self.intermediate.name,
-            "author": self.intermediate.author,
-            "version": self.intermediate.version,
-            "pack-format": "packwiz:1.1.0",
+            for resource in self.intermediate.resources:
+                self.add_resource(resource)
 
-            "index": {
-                "file": "index.toml",
-                "hash-format": "sha256",
-                "hash": get_hash(index_path)
-            },
+            index_data = encode_toml(self.index).encode("utf-8")
+            self.archive.write_text("index.toml", index_data)
 
-            "versions": {
-                self.intermediate.modloader.type: self.intermediate.modloader.version,
-                "minecraft": self.intermediate.minecraft_version
-            }
-        }
+            self.pack_info = {
+                "name": self.intermediate.name,
+                "author": self.intermediate.author,
+                "version": self.intermediate.version,
+                "pack-format": "packwiz:1.1.0",
+
+                "index": {
+                    "file": "index.toml",
+                    "hash-format": "sha256",
+                    "hash": get_hash(index_data)
+                },
 
-        with open(self.temp_dir / "pack.toml", "wb") as file:
-            write_toml(self.pack_info, file)
+                "versions": {
+                    self.intermediate.modloader.type: self.intermediate.modloader.version,
+                    "minecraft": self.intermediate.minecraft_version
+                }
+            }
 
-        from shutil import make_archive
-        name = get_name_from_scheme("PW", "Packwiz", self.intermediate)
-        make_archive((self.modpack_path / name).as_posix(), 'zip', self.temp_dir, '.')
+            self.archive.write_text("pack.toml", encode_toml(self.pack_info).encode("utf-8"))
@@ -0,0 +1,274 @@
+from concurrent.futures import Future
+from copy import copy
+from pathlib import Path
+from struct import unpack
+from threading import Lock
+from typing import Callable, Iterable, Iterator
+from zipfile import ZIP64_LIMIT, ZIP_DEFLATED, ZIP_STORED, ZipFile, ZipInfo
+
+from .structures import ArchivePath
+from .. import config
+
+
+def iter_raw(path: ArchivePath) -> Iterator[bytes]:
+
+    "Yields the data of an archive member as it is stored, without decompressing it"
+
+    info = path.root.getinfo(path.at)
+
+    with open(path.root.filename, "rb") as file: # type: ignore
+        file.seek(info.header_offset)
+        header = file.read(30)
+        if header[:4] != b"PK\x03\x04": raise ValueError(f"Bad local header of {path.at}")
+
+        name_length, extra_length = unpack("<HH", header[26:30])
+        file.seek(name_length + extra_length, 1)
+
+        remaining = info.compress_size
+        while remaining > 0:
+            chunk = file.read(min(remaining, config.HASH_CHUNK_SIZE))
+            if not chunk: raise EOFError(f"Truncated data of {path.at}")
+            remaining -= len(chunk); yield chunk
+
+def iter_file(path: Path) -> Iterator[bytes]:
+    with path.open("rb") as file:
+        while chunk := file.read(config.HASH_CHUNK_SIZE): yield chunk
+
+def get_compression(name: str) -> tuple[int, int | None]:
+
+    "Already compressed files are stored as they are, everything else is deflated at `config.compression_level`"
+
+    suffix = Path(name.removesuffix(".disabled")).suffix.lower()
+    if not config.compression_level or suffix in config.stored_suffixes: return ZIP_STORED, None
+    return ZIP_DEFLATED, config.compression_level
+
+def iter_deflated(source: Path, info: ZipInfo, level: int) -> Iterator[bytes]:
+
+    """Deflates `source` and completes `info` with its CRC and compressed size once exhausted.
+    Large files are split into blocks deflated by `config.compression_threads` threads,
+    each block is primed with the tail of the previous one, so the ratio barely suffers"""
+
+    import zlib
+
+    info.CRC = info.compress_size = 0
+    chunks = iter_file(source)
+
+    def counted(data: bytes) -> bytes:
+        info.compress_size += len(data)
+        return data
+
+    if config.compression_threads <= 1 or info.file_size < config.parallel_compression_size:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        for chunk in chunks:
+            info.CRC = zlib.crc32(chunk, info.CRC)
+            yield counted(compressor.compress(chunk))
+        yield counted(compressor.flush()); return
+
+    def deflate(block: bytes, previous: bytes, last: bool) -> bytes:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, **({"zdict": previous} if previous else {}))
+        return compressor.compress(block) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(config.compression_threads) as pool:
+
+        pending: deque[Future[bytes]] = deque()
+        block, previous = next(chunks, b""), b""
+
+        while True:
+            following = next(chunks, None)
+            info.CRC = zlib.crc32(block, info.CRC)
+            pending.append(pool.submit(deflate, block, previous[-32 * 1024:], following is None))
+            if following is None: break
+
+            block, previous = following, block
+            if len(pending) > 2 * config.compression_threads: yield counted(pending.popleft().result())
+
+        while pending: yield counted(pending.popleft().result())
+
+def write_raw(archive: ZipFile, arcname: str, info: ZipInfo, data: Iterable[bytes]) -> None:
+
+    """Appends already compressed `data` described by `info` as `arcname`, nothing is recompressed.
+    The local header is rewritten afterwards, as `data` may complete `info` while it is consumed"""
+
+    zinfo = copy(info)
+    zinfo.filename = zinfo.orig_filename = arcname
+    zinfo.flag_bits &= ~0x08 # sizes go to the local header, not to a data descriptor
+    zinfo.extra = b""
+
+    with archive._lock: # type: ignore
+        archive._writecheck(zinfo) # type: ignore
+        archive._didModify = True # type: ignore
+
+        archive.fp.seek(archive.start_dir) # type: ignore
+        zinfo.header_offset = archive.fp.tell() # type: ignore
+
+        zip64 = zinfo.file_size * 1.05 > ZIP64_LIMIT or zinfo.compress_size > ZIP64_LIMIT
+        archive.fp.write(zinfo.FileHeader(zip64)) # type: ignore
+        for chunk in data: archive.fp.write(chunk) # type: ignore
+
+        archive.start_dir = archive.fp.tell() # type: ignore
+        zinfo.CRC, zinfo.compress_size = info.CRC, info.compress_size
+        archive.fp.seek(zinfo.header_offset) # type: ignore
+        archive.fp.write(zinfo.FileHeader(zip64)) # type: ignore
+        archive.fp.seek(archive.start_dir) # type: ignore
+        archive.filelist.append(zinfo)
+        archive.NameToInfo[arcname] = zinfo
+
+
+class EntryStore(object):
+
+    """Compresses every source once, archives written at the same time copy the result as it is.
+    Sources are compressed by the first thread asking for them, the others wait for it"""
+
+    def __init__(self) -> None:
+
+        from tempfile import TemporaryDirectory
+
+        self._temp_dir = TemporaryDirectory()
+        self.temp_dir = Path(self._temp_dir.name)
+
+        self.entries: dict[Path | ArchivePath, Future[tuple[ZipInfo, Callable[[], Iterator[bytes]]]]] = dict()
+        self.lock = Lock()
+
+    def compress(self, source: Path) -> tuple[ZipInfo, Callable[[], Iterator[bytes]]]:
+
+        info = ZipInfo.from_file(source, source.name)
+        info.compress_type, level = get_compression(source.name)
+
+        if info.compress_type == ZIP_STORED:
+            import zlib
+            info.CRC = 0
+            for chunk in iter_file(source): info.CRC = zlib.crc32(chunk, info.CRC)
+            info.compress_size = info.file_size
+            return info, lambda: iter_file(source)
+
+        from tempfile import NamedTemporaryFile
+        with NamedTemporaryFile(dir=self.temp_dir, delete=False) as file:
+            for chunk in iter_deflated(source, info, level): file.write(chunk) # type: ignore
+
+        return info, lambda: iter_file(Path(file.name))
+
+    def get(self, source: Path | ArchivePath) -> tuple[ZipInfo, Callable[[], Iterator[bytes]]]:
+
+        with self.lock:
+            owner = source not in self.entries
+            future = self.entries.setdefault(source, Future())
+
+        if not owner: return future.result()
+
+        try:
+            if isinstance(source, Path): future.set_result(self.compress(source))
+            else: future.set_result((source.root.getinfo(source.at), lambda: iter_raw(source)))
+        except Exception as error: future.set_exception(error)
+
+        return future.result()
+
+    def close(self) -> None:
+        self._temp_dir.cleanup()
+
+
+class ArchiveWriter(object):
+
+    "Zip archive written next to its final path and moved into place once it is complete"
+
+    entries: EntryStore | None = None # set when several archives are written from the same sources
+
+    def __init__(self, path: Path) -> None:
+
+        self.path = path
+        self.temp_path = path.with_name(f".{path.name}.part")
+        self.archive = ZipFile(self.temp_path, "w", ZIP_DEFLATED)
+
+    def __enter__(self) -> "ArchiveWriter":
+        return self
+
+    def __exit__(self, exc_type, *args) -> None:
+
+        self.archive.close()
+
+        if exc_type: self.temp_path.unlink(missing_ok=True)
+        else: self.temp_path.replace(self.path)
+
+    def write_text(self, arcname: str, data: str | bytes) -> None:
+        self.archive.writestr(arcname, data, *get_compression(arcname))
+
+    def write_file(self, arcname: str, source: Path | ArchivePath, digest: str | None = None) -> None:
+
+        """Streams a file into the archive as `get_compression` decides for its name,
+        archive members are copied as they are stored, without recompressing them.
+        `digest` only matters to `DirectoryWriter`, archives are always written whole"""
+
+        if self.entries:
+            info, data = self.entries.get(source)
+            write_raw(self.archive, arcname, info, data())
+        elif isinstance(source, Path):
+            compress_type, level = get_compression(source.name)
+            info = ZipInfo.from_file(source, arcname)
+            if compress_type == ZIP_STORED or config.compression_threads <= 1 or info.file_size < config.parallel_compression_size:
+                return self.archive.write(source, arcname, compress_type, level)
+            info.compress_type, info.CRC = compress_type, 0
+            write_raw(self.archive, arcname, info, iter_deflated(source, info, level)) # type: ignore
+        else: write_raw(self.archive, arcname, source.root.getinfo(source.at), iter_raw(source))
+
+
+class DirectoryWriter(object):
+
+    """Updates an existing directory in place, only entries whose content changed are rewritten.
+    Entries of `known` (path to sha256) that aren't written again are stale and get removed"""
+
+    def __init__(self, path: Path, known: dict[str, str] | None = None) -> None:
+
+        self.path = path
+        self.known = known or dict()
+        self.written: set[str] = set()
+        self.changed: list[str] = list()
+        self.directories: set[Path] = set()
+
+    def __enter__(self) -> "DirectoryWriter":
+        return self
+
+    def __exit__(self, exc_type, *args) -> None:
+
+        if exc_type: return
+
+        stale = sorted(self.known.keys() - self.written)
+        for arcname in stale:
+            target = self.path / arcname
+            target.unlink(missing_ok=True)
+
+            # directories left empty go as well
+            for parent in target.parents:
+                if parent == self.path or any(parent.iterdir()): break
+                parent.rmdir()
+
+        print(f"{self.path}: {len(self.changed)} written, {len(stale)} removed, {len(self.written) - len(self.changed)} unchanged")
+
+    def get_target(self, arcname: str) -> Path:
+
+        self.written.add(arcname)
+
+        target = self.path / arcname
+        if target.parent not in self.directories:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            self.directories.add(target.parent)
+        return target
+
+    def write_text(self, arcname: str, data: str | bytes) -> None:
+
+        if isinstance(data, str): data = data.encode("utf-8")
+        target = self.get_target(arcname)
+
+        if target.is_file() and target.stat().st_size == len(data) and target.read_bytes() == data: return
+        target.write_bytes(data); self.changed.append(arcname)
+
+    def write_file(self, arcname: str, source: Path | ArchivePath, digest: str | None = None) -> None:
+
+        "`digest` is the sha256 of `source`, files already known with it aren't copied again"
+
+        from .utils import copy_file
+
+        target = self.get_target(arcname)
+        if digest and self.known.get(arcname) == digest and target.is_file(): return
+        copy_file(source, target); self.changed.append(arcname)
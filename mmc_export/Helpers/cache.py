@@ -0,0 +1,500 @@
+import sqlite3
+from dataclasses import asdict
+from contextlib import contextmanager, suppress
+from datetime import timedelta, timezone
+from json import dumps as encode_json
+from json import loads as parse_json
+from pathlib import Path
+from time import time
+from typing import IO, Any, Iterable, Iterator
+
+from aiohttp_client_cache.backends import CacheBackend
+from aiohttp_client_cache.response import CachedResponse
+from aiohttp_client_cache.session import CachedSession as BaseCachedSession
+
+from .structures import File, Resource
+from .utils import chunked
+from .. import config
+
+
+class MetadataCache(object):
+
+    "Single-file store for (meta, Resource) fingerprints and the stat index in front of it"
+
+    batch_size = 500
+
+    def __init__(self, path: Path | None = None) -> None:
+
+        self.path = path or config.DEFAULT_CACHE_DIR / "metadata.db"
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self.connection = sqlite3.connect(self.path, timeout=30)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS resources (
+                digest TEXT PRIMARY KEY,
+                meta TEXT NOT NULL,
+                resource TEXT NOT NULL,
+                accessed REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS stat_index (
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                digest TEXT NOT NULL,
+                accessed REAL NOT NULL,
+                PRIMARY KEY (path, size, mtime_ns, inode)
+            );
+            CREATE TABLE IF NOT EXISTS resolutions (
+                provider TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                data TEXT NOT NULL,
+                expires REAL NOT NULL,
+                PRIMARY KEY (provider, hash)
+            );
+            CREATE TABLE IF NOT EXISTS etags (
+                url TEXT PRIMARY KEY,
+                etag TEXT NOT NULL,
+                body TEXT NOT NULL,
+                accessed REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS downloads (
+                url TEXT PRIMARY KEY,
+                sha1 TEXT NOT NULL,
+                sha256 TEXT NOT NULL,
+                sha512 TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                accessed REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS stats (
+                name TEXT PRIMARY KEY,
+                hits INTEGER NOT NULL,
+                misses INTEGER NOT NULL
+            );
+        """)
+
+        self.migrate(config.DEFAULT_CACHE_DIR / "v7")
+
+    @staticmethod
+    def dump_resource(resource: Resource) -> str:
+        return encode_json({"name": resource.name, "hash": asdict(resource.file.hash), "size": resource.file.size})
+
+    @staticmethod
+    def load_resource(data: str) -> Resource:
+        fields = parse_json(data)
+        file = File(hash=File.Hash(**fields['hash']), size=fields['size'])
+        return Resource(fields['name'], file=file)
+
+    def get_many(self, digests: Iterable[str]) -> dict[str, tuple[dict, Resource]]:
+
+        entries: dict[str, tuple[dict, Resource]] = dict()
+
+        for batch in chunked(list(set(digests)), self.batch_size):
+            query = f"SELECT digest, meta, resource FROM resources WHERE digest IN ({','.join('?' * len(batch))})"
+            for digest, meta, resource in self.connection.execute(query, batch):
+                entries[digest] = parse_json(meta), self.load_resource(resource)
+
+        with self.connection:
+            self.connection.executemany("UPDATE resources SET accessed = ? WHERE digest = ?",
+                ((time(), digest) for digest in entries))
+
+        return entries
+
+    def put_many(self, entries: dict[str, tuple[dict, Resource]]) -> None:
+
+        rows = ((digest, encode_json(meta), self.dump_resource(resource), time())
+            for digest, (meta, resource) in entries.items())
+
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO resources VALUES (?, ?, ?, ?)", rows)
+
+    def get_digests(self, keys: Iterable[tuple]) -> dict[tuple, str]:
+
+        digests: dict[tuple, str] = dict()
+
+        for batch in chunked(list(set(keys)), self.batch_size):
+            query = ("SELECT path, size, mtime_ns, inode, digest FROM stat_index "
+                f"WHERE (path, size, mtime_ns, inode) IN (VALUES {','.join(['(?, ?, ?, ?)'] * len(batch))})")
+            for *key, digest in self.connection.execute(query, [field for key in batch for field in key]):
+                digests[tuple(key)] = digest
+
+        with self.connection:
+            self.connection.executemany("UPDATE stat_index SET accessed = ? "
+                "WHERE path = ? AND size = ? AND mtime_ns = ? AND inode = ?",
+                ((time(), *key) for key in digests))
+
+        return digests
+
+    def put_digests(self, digests: dict[tuple, str]) -> None:
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO stat_index VALUES (?, ?, ?, ?, ?, ?)",
+                (key + (digest, time()) for key, digest in digests.items()))
+
+    def get_resolutions(self, provider: str, hashes: Iterable[str], stale: bool = False) -> dict[str, dict]:
+
+        "Expired entries are only returned with `stale`, so offline runs resolve whatever is on disk"
+
+        resolutions: dict[str, dict] = dict()
+        now = 0 if stale else time()
+
+        for batch in chunked(list(set(hashes)), self.batch_size):
+            query = f"SELECT hash, data FROM resolutions WHERE provider = ? AND expires > ? AND hash IN ({','.join('?' * len(batch))})"
+            for hash, data in self.connection.execute(query, (provider, now, *batch)):
+                resolutions[hash] = parse_json(data)
+
+        return resolutions
+
+    def put_resolutions(self, provider: str, resolutions: dict[str, dict]) -> None:
+
+        "Entries without a provider are negative and expire sooner"
+
+        ttl = lambda data: config.resolution_ttl if data['provider'] else config.negative_resolution_ttl
+        rows = ((provider, hash, encode_json(data), time() + ttl(data)) for hash, data in resolutions.items())
+
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO resolutions VALUES (?, ?, ?, ?)", rows)
+
+    def get_etag(self, url: str) -> tuple[str, Any] | None:
+
+        query = "SELECT etag, body FROM etags WHERE url = ?"
+        if not (row := self.connection.execute(query, (url,)).fetchone()): return None
+
+        with self.connection:
+            self.connection.execute("UPDATE etags SET accessed = ? WHERE url = ?", (time(), url))
+
+        return row[0], parse_json(row[1])
+
+    def put_etag(self, url: str, etag: str, body: Any) -> None:
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO etags VALUES (?, ?, ?, ?)", (url, etag, encode_json(body), time()))
+
+    def get_downloads(self, urls: Iterable[str]) -> dict[str, tuple[str, str, str, int]]:
+
+        "Returns (sha1, sha256, sha512, size) of every url downloaded before"
+
+        downloads: dict[str, tuple[str, str, str, int]] = dict()
+
+        for batch in chunked(list(set(urls)), self.batch_size):
+            query = f"SELECT url, sha1, sha256, sha512, size FROM downloads WHERE url IN ({','.join('?' * len(batch))})"
+            for url, *fields in self.connection.execute(query, batch): downloads[url] = tuple(fields) # type: ignore
+
+        with self.connection:
+            self.connection.executemany("UPDATE downloads SET accessed = ? WHERE url = ?", ((time(), url) for url in downloads))
+
+        return downloads
+
+    def put_downloads(self, downloads: dict[str, tuple[str, str, str, int]]) -> None:
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?, ?)",
+                ((url, *fields, time()) for url, fields in downloads.items()))
+
+    def record(self, name: str, hits: int, misses: int) -> None:
+
+        if not hits and not misses: return
+
+        with self.connection:
+            self.connection.execute("INSERT INTO stats VALUES (?, ?, ?) ON CONFLICT (name) "
+                "DO UPDATE SET hits = hits + excluded.hits, misses = misses + excluded.misses", (name, hits, misses))
+
+    def get_hit_rates(self) -> dict[str, tuple[int, int]]:
+        return {name: (hits, misses) for name, hits, misses in self.connection.execute("SELECT * FROM stats")}
+
+    def get_size(self) -> tuple[int, int]:
+        query = "SELECT count(*), coalesce(sum(length(meta) + length(resource)), 0) FROM resources"
+        return self.connection.execute(query).fetchone()
+
+    def get_resolutions_size(self) -> tuple[int, int]:
+        query = "SELECT count(*), coalesce(sum(length(data)), 0) FROM resolutions"
+        return self.connection.execute(query).fetchone()
+
+    def get_etags_size(self) -> tuple[int, int]:
+        query = "SELECT count(*), coalesce(sum(length(body)), 0) FROM etags"
+        return self.connection.execute(query).fetchone()
+
+    def evict(self, max_size: int, max_age: int) -> None:
+
+        "Drops entries unused for `max_age` seconds, then least recently used ones above `max_size` bytes"
+
+        changes = self.connection.total_changes
+
+        with self.connection:
+
+            self.connection.execute("DELETE FROM resources WHERE accessed < ?", (time() - max_age,))
+            self.connection.execute("DELETE FROM stat_index WHERE accessed < ?", (time() - max_age,))
+            self.connection.execute("DELETE FROM resolutions WHERE expires < ?", (time(),))
+            self.connection.execute("DELETE FROM etags WHERE accessed < ?", (time() - max_age,))
+            self.connection.execute("DELETE FROM downloads WHERE accessed < ?", (time() - max_age,))
+
+            self.connection.execute("""
+                DELETE FROM resources WHERE digest IN (
+                    SELECT digest FROM (
+                        SELECT digest, sum(length(meta) + length(resource)) 
+                            OVER (ORDER BY accessed DESC) AS total FROM resources
+                    ) WHERE total > ?
+                )""", (max_size,))
+
+            self.connection.execute("DELETE FROM stat_index WHERE digest NOT IN (SELECT digest FROM resources)")
+
+            self.connection.execute("""
+                DELETE FROM etags WHERE url IN (
+                    SELECT url FROM (
+                        SELECT url, sum(length(body)) OVER (ORDER BY accessed DESC) AS total FROM etags
+                    ) WHERE total > ?
+                )""", (max_size,))
+
+            # resolutions aren't touched when read, the latest written expire last
+            self.connection.execute("""
+                DELETE FROM resolutions WHERE rowid IN (
+                    SELECT rowid FROM (
+                        SELECT rowid, sum(length(data)) OVER (ORDER BY expires DESC) AS total FROM resolutions
+                    ) WHERE total > ?
+                )""", (max_size,))
+
+        if self.connection.total_changes > changes: self.connection.execute("VACUUM")
+
+    def migrate(self, directory: Path) -> None:
+
+        "Imports the legacy one-pickle-per-jar cache directory and removes it"
+
+        if not directory.is_dir(): return
+
+        from pickle import loads as deserialize
+        from shutil import rmtree
+
+        entries: dict[str, tuple[dict, Resource]] = dict()
+        digests: dict[tuple, str] = dict()
+
+        for file in directory.iterdir():
+            try:
+                if file.name == "stat.index": digests.update(deserialize(file.read_bytes()))
+                else: entries[file.name] = deserialize(file.read_bytes())
+            except Exception: continue
+
+        self.put_many(entries)
+        self.put_digests(digests)
+        rmtree(directory, ignore_errors=True)
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class BlobStore(object):
+
+    "Files addressed by their sha512, written while they are downloaded so they are never held in memory"
+
+    def __init__(self, path: Path | None = None) -> None:
+        self.path = path or config.DEFAULT_CACHE_DIR / "blobs"
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def get_path(self, digest: str) -> Path:
+        return self.path / digest[:2] / digest
+
+    def contains(self, digest: str) -> bool:
+        return self.get_path(digest).is_file()
+
+    def touch(self, digest: str) -> None:
+
+        "Marks a blob as used, trimming goes by access time"
+
+        from os import utime
+        utime(self.get_path(digest))
+
+    @contextmanager
+    def create(self) -> Iterator[IO[bytes]]:
+
+        "Yields a temporary blob, it is kept only if `commit` names it by its digest"
+
+        from tempfile import NamedTemporaryFile
+        file = NamedTemporaryFile(dir=self.path, suffix=".part", delete=False)
+
+        try:
+            with file: yield file
+        finally: Path(file.name).unlink(missing_ok=True)
+
+    def commit(self, file: IO[bytes], digest: str) -> Path:
+
+        file.close()
+        path = self.get_path(digest)
+        path.parent.mkdir(exist_ok=True)
+
+        from os import replace
+        replace(file.name, path)
+        return path
+
+    def get_entries(self) -> list[tuple[float, int, Path]]:
+
+        entries: list[tuple[float, int, Path]] = list()
+
+        for path in self.path.glob("*/*"):
+            with suppress(OSError):
+                info = path.stat()
+                entries.append((info.st_atime, info.st_size, path))
+
+        return entries
+
+    def evict(self, max_size: int, max_age: int) -> None:
+
+        total = 0
+
+        for accessed, size, path in sorted(self.get_entries(), reverse=True):
+            total += size
+            if accessed < time() - max_age or total > max_size:
+                path.unlink(missing_ok=True)
+
+
+class CachedSession(BaseCachedSession):
+
+    "Counts web cache hits and misses for `cache-stats`"
+
+    hits: int = 0
+    misses: int = 0
+
+    async def _request(self, *args, **kwargs) -> CachedResponse:
+
+        response = await super()._request(*args, **kwargs)
+
+        if not self.cache.disabled:
+            if response.from_cache: self.hits += 1
+            else: self.misses += 1
+
+        return response
+
+
+def get_web_cache() -> CacheBackend:
+
+    "Builds the HTTP cache backend chosen by `config.web_cache_backend`, stored at `config.web_cache_location`"
+
+    options: dict[str, Any] = dict(urls_expire_after={'*.jar': 0}, allowed_methods=("GET", "POST", "HEAD"))
+    location = config.web_cache_location
+
+    match config.web_cache_backend:
+        case "sqlite":
+            from aiohttp_client_cache.backends.sqlite import SQLiteBackend
+            return SQLiteBackend(str(location or config.DEFAULT_CACHE_DIR.with_name("mmc-export-web.sqlite")), **options)
+        case "redis":
+            from aiohttp_client_cache.backends.redis import RedisBackend
+            return RedisBackend("mmc-export", address=location or "redis://localhost", **options)
+        case "filesystem":
+            from aiohttp_client_cache.backends.filesystem import FileBackend
+            return FileBackend(location or "mmc-export", use_temp=not location, **options)
+        case _: raise TypeError("Incorrect web cache backend!")
+
+async def get_sqlite_entries(responses: Any) -> list[tuple[float, int, str]]:
+
+    """Rows carry no timestamp, so the time a row version (rowid and size) was first seen
+    is kept in a table next to them, nothing has to be unpickled"""
+
+    table, seen = responses.table_name, f"{responses.table_name}-seen"
+
+    async with responses.get_connection(commit=True) as db:
+        await db.execute(f"CREATE TABLE IF NOT EXISTS `{seen}` (key PRIMARY KEY, version TEXT, seen REAL)")
+        await db.execute(f"DELETE FROM `{seen}` WHERE key NOT IN (SELECT key FROM `{table}`)")
+        await db.execute(f"INSERT INTO `{seen}` SELECT key, rowid || ':' || length(value), ? FROM `{table}` WHERE true "
+            "ON CONFLICT (key) DO UPDATE SET version = excluded.version, seen = excluded.seen WHERE version != excluded.version", (time(),))
+
+        cursor = await db.execute(f"SELECT `{seen}`.seen, length(value), key FROM `{table}` JOIN `{seen}` USING (key)")
+        return [tuple(row) for row in await cursor.fetchall()] # type: ignore
+
+async def get_redis_entries(responses: Any) -> list[tuple[float, int, str]]:
+
+    "Same as `get_sqlite_entries`, the size of a field tells its versions apart"
+
+    connection = await responses.get_connection()
+    seen_key = f"{responses.hash_key}:seen"
+    keys = await connection.hkeys(responses.hash_key)
+
+    pipeline = connection.pipeline()
+    for key in keys: pipeline.hstrlen(responses.hash_key, key)
+    sizes = await pipeline.execute()
+
+    seen = {key: value.decode().split(":") for key, value in (await connection.hgetall(seen_key)).items()}
+    if stale := seen.keys() - set(keys): await connection.hdel(seen_key, *stale)
+
+    entries: list[tuple[float, int, str]] = list()
+    updated: dict[bytes, str] = dict()
+
+    for key, size in zip(keys, sizes):
+        if key not in seen or int(seen[key][0]) != size:
+            seen[key] = [str(size), str(time())]
+            updated[key] = ":".join(seen[key])
+        entries.append((float(seen[key][1]), size, key.decode()))
+
+    if updated: await connection.hset(seen_key, mapping=updated)
+    return entries
+
+async def get_web_cache_entries(cache: CacheBackend) -> list[tuple[float, int, str]]:
+
+    "Returns (last write, size, key) for every cached response, bodies are only loaded for unknown backends"
+
+    entries: list[tuple[float, int, str]] = list()
+
+    if hasattr(cache.responses, "paths"):
+        from os import stat
+        async for key in cache.responses.keys():
+            with suppress(OSError):
+                info = stat(cache.responses._join(key)) # type: ignore
+                entries.append((info.st_atime, info.st_size, key))
+        return entries
+
+    if hasattr(cache.responses, "table_name"): return await get_sqlite_entries(cache.responses)
+    if hasattr(cache.responses, "hash_key"): return await get_redis_entries(cache.responses)
+
+    async for key in cache.responses.keys():
+        response = await cache.responses.read(key)
+        if isinstance(response, CachedResponse):
+            accessed = response.created_at.replace(tzinfo=timezone.utc).timestamp()
+            entries.append((accessed, len(response._body or b''), key))
+
+    return entries
+
+async def evict_web_cache(cache: CacheBackend, max_size: int, max_age: int) -> None:
+
+    entries = sorted(await get_web_cache_entries(cache), reverse=True)
+    expired: set[str] = set()
+    total = 0
+
+    for accessed, size, key in entries:
+        total += size
+        if accessed < time() - max_age or total > max_size:
+            expired.add(key)
+
+    if expired: await cache.bulk_delete(expired)
+
+async def collect_garbage(session: CachedSession) -> None:
+
+    "Bounds every on-disk cache by size and age, runs at the end of each export"
+
+    metadata_cache = MetadataCache()
+    metadata_cache.record("web", session.hits, session.misses)
+    metadata_cache.evict(config.cache_max_size, config.cache_max_age)
+    metadata_cache.close()
+
+    BlobStore().evict(config.cache_max_size, config.cache_max_age)
+
+    await evict_web_cache(session.cache, config.cache_max_size, config.cache_max_age)
+
+async def print_cache_stats(session: CachedSession) -> None:
+
+    metadata_cache = MetadataCache()
+    count, size = metadata_cache.get_size()
+    resolutions_count, resolutions_size = metadata_cache.get_resolutions_size()
+    etags_count, etags_size = metadata_cache.get_etags_size()
+    hit_rates = metadata_cache.get_hit_rates()
+    metadata_cache.close()
+
+    blob_entries = BlobStore().get_entries()
+    blob_size = sum(size for _, size, _ in blob_entries)
+
+    web_entries = await get_web_cache_entries(session.cache)
+    web_size = sum(size for _, size, _ in web_entries)
+
+    to_mib = lambda size: f"{size / 1024**2:.2f} MiB"
+    print(f"Metadata cache: {count} entries, {to_mib(size)}")
+    print(f"Providers cache: {resolutions_count} entries, {to_mib(resolutions_size)}")
+    print(f"ETags cache: {etags_count} entries, {to_mib(etags_size)}")
+    print(f"Blob store: {len(blob_entries)} files, {to_mib(blob_size)}")
+    print(f"Web cache: {len(web_entries)} entries, {to_mib(web_size)}")
+    print(f"Limits: {to_mib(config.cache_max_size)} and {timedelta(seconds=config.cache_max_age).days} days per cache")
+
+    for name, (hits, misses) in sorted(hit_rates.items()):
+        print(f"{name.capitalize()} hit rate: {hits / (hits + misses):.1%} ({hits} hits, {misses} misses)")
@@ -1,24 +1,109 @@
 import asyncio
-from collections import namedtuple
+from collections import Counter
+from contextlib import suppress
+from dataclasses import asdict
+from copy import deepcopy
 from datetime import datetime
+from json import dumps as encode_json
 from json import loads as parse_json
 from pathlib import Path
-from re import compile as re_compile
+from typing import IO, Any, Awaitable, Callable, Mapping
 from urllib.parse import urlparse
 from zipfile import ZipFile
 
 import tenacity as tn
+from aiohttp import ClientError
 from aiohttp_client_cache.session import CachedSession
 
-from .structures import Intermediate, Resource
-from .utils import delete_github_token, get_github_token, get_hash
+from .cache import MetadataCache
+from .scheduler import RateLimited, Scheduler
+from .structures import ArchivePath, Intermediate, Resource, open_archive
+from .utils import chunked, delete_github_token, get_github_token, get_hashes
 from .. import config
 
 
+def get_raw_info(path: Path | ArchivePath) -> tuple[str, dict, Resource]:
+
+    "Fingerprints a single file, runs in worker processes so it must stay picklable"
+
+    if isinstance(path, Path): return inspect_file(path, path, path.stat().st_size)
+
+    # archive members are spooled once, so nested jars can be hashed and inspected
+    # without decompressing the member again for every seek
+    from shutil import copyfileobj
+    from tempfile import SpooledTemporaryFile
+
+    with path.open("rb") as member, SpooledTemporaryFile(config.SPOOL_MAX_SIZE) as file:
+        copyfileobj(member, file, config.HASH_CHUNK_SIZE); file.seek(0)
+        return inspect_file(path, file, path.root.getinfo(path.at).file_size)
+
+def inspect_file(path: Path | ArchivePath, file: Path | IO[bytes], size: int) -> tuple[str, dict, Resource]:
+
+    digest, sha1, sha256, sha512, murmur2 = get_hashes(file, "xxhash", "sha1", "sha256", "sha512", "murmur2")
+
+    meta = {"name": path.stem,
+            "id": None,
+            "version": "0.0.0"}
+
+    if path.suffix in (".jar", ".disabled"):
+        with ZipFile(file) as modArchive:
+            filenames = [Path(name).name for name in modArchive.namelist()]
+            if "fabric.mod.json" in filenames:
+                data = modArchive.read("fabric.mod.json")
+                meta = parse_json(data, strict=False)
+            elif "pack.mcmeta" in filenames:
+                data = modArchive.read("pack.mcmeta")
+                json = parse_json(data, strict=False)
+                meta['name'] = json['pack']['description']
+
+    resource = Resource(meta['name'])
+    resource.file.hash.sha1 = sha1
+    resource.file.hash.sha256 = sha256
+    resource.file.hash.sha512 = sha512
+    resource.file.hash.murmur2 = murmur2
+
+    resource.file.size = size
+
+    return digest, meta, resource
+
+
+class RetryableResponse(Exception):
+
+    def __init__(self, status: int, retry_after: float | None = None) -> None:
+        self.status, self.retry_after = status, retry_after
+        super().__init__(f"HTTP {status}")
+
+    @classmethod
+    def from_headers(cls, status: int, headers: Mapping[str, str]) -> "RetryableResponse":
+
+        if not (value := headers.get("Retry-After")): return cls(status)
+        with suppress(ValueError): return cls(status, float(value))
+
+        from email.utils import parsedate_to_datetime
+        with suppress(TypeError, ValueError): 
+            return cls(status, parsedate_to_datetime(value).timestamp() - datetime.now().timestamp())
+
+        return cls(status)
+
+
+def wait_retry_after(retry_state: tn.RetryCallState) -> float:
+
+    "Waits as long as the server asked to, exponential backoff with jitter otherwise"
+
+    exception = retry_state.outcome.exception() if retry_state.outcome else None
+    if isinstance(exception, RetryableResponse) and exception.retry_after is not None:
+        return min(max(exception.retry_after, 0), 60)
+
+    return tn.wait.wait_exponential_jitter(initial=1, max=30)(retry_state)
+
+
 class ResourceAPI(object):
 
     modrinth_search_type: str
     excluded_providers: list[str]
+    jobs: int = 1
+    offline: bool = False
+    formats: list[str] = list()
 
     def __init__(self, session: CachedSession, intermediate: Intermediate) -> None:
 
@@ -34,58 +119,70 @@ class ResourceAPI(object):
         self.modrinth = "https://api.modrinth.com/v2"
         self.curseforge = "https://api.curseforge.com/v1"
 
-        self.cache_directory = config.DEFAULT_CACHE_DIR / "v7"
-        self.cache_directory.mkdir(parents=True, exist_ok=True)
+        self.metadata_cache = MetadataCache()
+        self.scheduler = Scheduler()
+        self.failures: Counter[str] = Counter()
 
         super().__init__()
 
-    def _get_raw_info(self, path: Path) -> tuple[dict, Resource]:
-
-        from pickle import HIGHEST_PROTOCOL
-        from pickle import dumps as serialize
-        from pickle import loads as deserialize
-
-        cache_file = self.cache_directory / get_hash(path, "xxhash")
-        if cache_file.exists():
-            data = cache_file.read_bytes()
-            meta, resource = deserialize(data)
-        else:
-            meta = {"name": path.stem,
-                    "id": None,
-                    "version": "0.0.0"}
-
-            if path.suffix in (".jar", ".disabled"):
-                with ZipFile(path) as modArchive:
-                    filenames = [Path(file).name for file in modArchive.namelist()]
-                    if "fabric.mod.json" in filenames:
-                        data = modArchive.read("fabric.mod.json")
-                        meta = parse_json(data, strict=False)
-                    elif "pack.mcmeta" in filenames:
-                        data = modArchive.read("pack.mcmeta")
-                        json = parse_json(data, strict=False)
-                        meta['name'] = json['pack']['description']
-                    
-
-            resource = Resource(meta['name'])
-            file_data = path.read_bytes()
-            resource.file.hash.sha1 = get_hash(file_data, "sha1")
-            resource.file.hash.sha256 = get_hash(file_data, "sha256")
-            resource.file.hash.sha512 = get_hash(file_data, "sha512")
-            resource.file.hash.murmur2 = get_hash(file_data, "murmur2")
-
-            resource.file.size = path.stat().st_size
-
-            to_cache = meta, resource
-            data = serialize(to_cache, HIGHEST_PROTOCOL)
-            cache_file.write_bytes(data)
+    async def _request(self, method: str, url: str, response_headers: dict | None = None, **kwargs: Any) -> tuple[int, Any]:
 
-        resource.file.path = path
-        resource.file.name = path.name
-        resource.file.relativePath = path.parent.name
+        """Sends a single request and returns its status and decoded json body, headers are copied into `response_headers`. 
+        Only this request is retried on failure, status 0 means it never succeeded"""
+
+        retrying = tn.AsyncRetrying(stop=tn.stop.stop_after_attempt(5), wait=wait_retry_after,
+            retry=tn.retry_if_exception_type((ClientError, asyncio.TimeoutError, RetryableResponse)))
+
+        try:
+            async for attempt in retrying:
+                with attempt:
+                    async with self.scheduler.slot(url) as bucket, self.session.request(method, url, **kwargs) as response:
+
+                        # GitHub doesn't count revalidations, their headers would still lower the local count
+                        if getattr(response, "from_cache", False) or response.status == 304: bucket.release()
+                        else: self.scheduler.update(bucket, response.headers)
+
+                        # GitHub refuses with 403 and Retry-After when its secondary rate-limit kicks in
+                        throttled = response.status == 429 or response.status == 403 and "Retry-After" in response.headers
+
+                        if throttled or response.status in (500, 502, 503, 504):
+                            error = RetryableResponse.from_headers(response.status, response.headers)
+                            if throttled: bucket.update(bucket.capacity, 0, error.retry_after or 1) # type: ignore
+                            raise error
+
+                        # refusals aren't answers, only 404 may be cached as "not found"
+                        if response.status >= 400 and response.status != 404: self.failures[urlparse(url).netloc] += 1
+                        if response_headers is not None: response_headers.update(response.headers)
+
+                        try: return response.status, await response.json(content_type=None)
+                        except ValueError: return response.status, None
+
+        except RateLimited:
+            self.failures[urlparse(url).netloc] += 1
+            return 429, None
+        except tn.RetryError as error: 
+            print(f"Request to {url.split('?')[0]} failed: {error.last_attempt.exception()}")
+
+        self.failures[urlparse(url).netloc] += 1
+        return 0, None
+
+    async def _get_conditional(self, url: str, extract: Callable[[Any], Any] = lambda data: data) -> tuple[int, Any]:
+
+        """Revalidates the stored body with its ETag, GitHub doesn't count 304 responses against the rate-limit.
+        The HTTP cache is bypassed, and the stored body is used as well when the request fails.
+        Only what `extract` keeps of a fresh body is stored and returned"""
+
+        headers = {"If-None-Match": etag} if (stored := self.metadata_cache.get_etag(url)) and (etag := stored[0]) else dict()
+        response_headers: dict[str, str] = dict()
+
+        status, data = await self._request("GET", url, response_headers=response_headers, headers=headers, expire_after=0)
+        self.metadata_cache.record("etags", status == 304, status == 200)
+
+        if status == 200: data = extract(data)
+        if status == 200 and (etag := response_headers.get("ETag")): self.metadata_cache.put_etag(url, etag, data)
+        if status != 200 and stored: return 304, stored[1]
+        return status, data
 
-        return meta, resource
-    
-    @tn.retry(stop=tn.stop.stop_after_attempt(5), wait=tn.wait.wait_fixed(1))
     async def _get_github(self, meta: dict, resource: Resource) -> None:
 
         if "contact" not in meta or "GitHub" in self.excluded_providers: return
@@ -105,79 +202,258 @@ class ResourceAPI(object):
 
         else: return
 
-        async with self.session.get(f"https://api.github.com/repos/{owner}/{repo}/releases") as response:
-            if response.status != 200 and response.status != 504: return
+        # release listings are large, only the fields read below are kept
+        extract = lambda releases: [{
+            "author": {"login": (release.get('author') or dict()).get('login')},
+            "assets": [{"name": asset['name'], "browser_download_url": asset['browser_download_url']} for asset in release['assets']]
+        } for release in releases]
 
-            for release in await response.json():
-                for asset in release['assets']:
-                    if asset['name'] == resource.file.name:
-                        url = asset['browser_download_url']
-                        author = release['author']['login']
-                        break
-                else: continue
-                break
-            else: return
+        status, releases = await self._get_conditional(f"{self.github}/repos/{owner}/{repo}/releases", extract)
+        if status != 200 and status != 304: return
 
-            resource.providers['Other'] = Resource.Provider(
-                ID     = None,
-                fileID = None,
-                url    = url,
-                slug   = meta['id'],
-                author = author)
+        for release in releases:
+            for asset in release['assets']:
+                if asset['name'] == resource.file.name:
+                    url = asset['browser_download_url']
+                    author = release['author']['login']
+                    break
+            else: continue
+            break
+        else: return
+
+        resource.providers['Other'] = Resource.Provider(
+            ID     = None,
+            fileID = None,
+            url    = url,
+            slug   = meta['id'],
+            author = author)
 
 
 class ResourceAPI_Batched(ResourceAPI):
 
+    batch_size = 100
+    batch_window = 0.25 # seconds to wait for a batch to fill up
+    github_page_size = 25 # releases per repository and page
+    github_assets = 50 # assets looked at per release
+    github_max_pages = 4 # pages of releases searched per repository
+
     def __init__(self, session: CachedSession, intermediate: Intermediate) -> None:
 
         self.queue: list[tuple[dict, Resource]] = list()
+        self.stream: asyncio.Queue[tuple[dict, Resource] | None] = asyncio.Queue()
+        self.github_ratelimit_checked = False
+        self.chunk_semaphore = asyncio.Semaphore(config.lookup_concurrency)
+        self.uncached: dict[str, Resource] = dict()
 
         super().__init__(session, intermediate)
 
-    def queue_resource(self, path: Path) -> None:
+    def queue_resource(self, path: Path | ArchivePath, meta: dict | None = None, resource: Resource | None = None) -> None:
 
-        meta, resource = self._get_raw_info(path)
+        if meta is None or resource is None:
+            digest, meta, resource = get_raw_info(path)
+            self.metadata_cache.put_many({digest: (meta, resource)})
+
+        resource.file.path = path
+        resource.file.name = path.name
+        resource.file.relativePath = path.parent.name
         
         if path.suffix == ".disabled": 
             resource.optional = True
             resource.file.disabled = True
-            resource.file.path = path.replace(path.with_suffix(''))
-            resource.file.name = resource.file.path.name
+            resource.file.name = path.name.removesuffix(".disabled")
 
         self.queue.append((meta, resource))
+        self.stream.put_nowait((meta, resource))
+
+    async def queue_resources(self, paths: list[Path | ArchivePath], stat_keys: dict[Path | ArchivePath, tuple] | None = None) -> None:
+
+        """Fingerprints files and streams them to `gather` as they are ready,
+        unchanged files are resolved through the stat index without reading them"""
+
+        stat_keys = stat_keys or dict()
+        digests = self.metadata_cache.get_digests(key for key in stat_keys.values())
+        cached = self.metadata_cache.get_many(digests.values())
+
+        hashed: dict[Path | ArchivePath, tuple[str, dict, Resource]] = dict()
+        to_hash: list[Path | ArchivePath] = list()
+
+        for path in paths:
+            if (key := stat_keys.get(path)) and (digest := digests.get(key)) in cached:
+                self.queue_resource(path, *deepcopy(cached[digest]))
+            else: to_hash.append(path)
+
+        async def fingerprint(path: Path | ArchivePath, future: Awaitable) -> None:
+            hashed[path] = digest, meta, resource = await future
+            self.queue_resource(path, meta, resource)
+
+        try:
+            if self.jobs <= 1 or len(to_hash) <= 1:
+                for path in to_hash: await fingerprint(path, asyncio.to_thread(get_raw_info, path))
+            else:
+                from concurrent.futures import ProcessPoolExecutor
+
+                loop = asyncio.get_running_loop()
+                with ProcessPoolExecutor(min(self.jobs, len(to_hash)), initializer=open_archive.cache_clear) as pool:
+                    await asyncio.gather(*(fingerprint(path, loop.run_in_executor(pool, get_raw_info, path)) for path in to_hash))
+        finally:
+            order = {path: n for n, path in enumerate(paths)}
+            self.queue.sort(key=lambda entry: order[entry[1].file.path])
+            self.stream.put_nowait(None)
+
+        self.metadata_cache.record("metadata", len(paths) - len(to_hash), len(to_hash))
+        self.metadata_cache.put_many({digest: (meta, resource) for digest, meta, resource in hashed.values()})
+        self.metadata_cache.put_digests({stat_keys[path]: hashed[path][0] for path in hashed if path in stat_keys})
+
+    async def get_batch(self) -> list[tuple[dict, Resource]]:
+
+        "Collects fingerprints until the batch is full or the time window is over"
+
+        if (entry := await self.stream.get()) is None: return []
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.batch_window
+        batch = [entry]
+
+        while len(batch) < self.batch_size:
+            try: entry = await asyncio.wait_for(self.stream.get(), max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError: break
+            if entry is None: self.stream.put_nowait(None); break
+            batch.append(entry)
+
+        return batch
 
     async def gather(self) -> list[Resource]:
 
-        futures = (
-            self._get_batched_curseforge(),
-            self._get_batched_modrinth(),
-            self._get_batched_github()
-        )
+        "Looks up batches of fingerprints while `queue_resources` is still producing them"
 
-        await asyncio.gather(*futures)
+        lookups: list[asyncio.Future] = list()
+
+        while batch := await self.get_batch():
+            lookups.append(asyncio.ensure_future(self.lookup(batch)))
+
+        await asyncio.gather(*lookups)
         resources = [resource for _, resource in self.queue]
         return resources
 
-    @tn.retry(stop=tn.stop.stop_after_attempt(5), wait=tn.wait.wait_fixed(1))
-    async def _get_batched_curseforge(self) -> None:
+    def is_needed(self, provider: str, resource: Resource) -> bool:
+
+        "Whether any requested format would use `provider` for this resource, given the matches it already has"
+
+        preferences = {
+            "CurseForge": ("CurseForge",),
+            "Modrinth": tuple(prior for prior in config.providers_priority if prior != "CurseForge"),
+            "packwiz": config.providers_priority
+        }
+
+        if not self.formats: return True
+
+        for format in self.formats:
+            if (preference := preferences.get(format)) is None: return True # Intermediate keeps every provider
+            if provider not in preference: continue
+            if not any(prior in resource.providers for prior in preference[:preference.index(provider)]): return True
+
+        return False
+
+    async def lookup(self, batch: list[tuple[dict, Resource]]) -> None:
+
+        "Runs provider passes in priority order, each only for resources the requested formats still need it for"
+
+        passes = {
+            "CurseForge": ("CurseForge", self._get_batched_curseforge),
+            "Modrinth": ("Modrinth", self._get_batched_modrinth),
+            "Other": ("GitHub", self._get_batched_github)
+        }
+
+        for name in config.providers_priority:
+            provider, lookup = passes[name]
+            await self._resolve(provider, lookup, [(meta, resource) for meta, resource in batch if self.is_needed(name, resource)])
+
+    async def _resolve(self, provider: str, lookup: Callable[[list], Awaitable[None]], batch: list[tuple[dict, Resource]]) -> None:
+
+        """Replays cached provider lookups and runs the rest, their outcome is cached as well,
+        "not found" included unless a request to the provider failed meanwhile"""
+
+        if provider in self.excluded_providers: return
+
+        name = "Other" if provider == "GitHub" else provider
+        host = urlparse({"CurseForge": self.curseforge, "Modrinth": self.modrinth, "GitHub": self.github}[provider]).netloc
+        cache_name = provider if provider != "Modrinth" or self.modrinth_search_type == "exact" \
+            else f"{provider}-{self.modrinth_search_type}"
+        get_key = lambda resource: resource.file.hash.murmur2 if provider == "CurseForge" else resource.file.hash.sha1
+
+        cached = dict() if self.session.cache.disabled else \
+            self.metadata_cache.get_resolutions(cache_name, (get_key(resource) for _, resource in batch), stale=self.offline)
+        pending: list[tuple[dict, Resource]] = list()
+
+        for meta, resource in batch:
+            if (resolution := cached.get(get_key(resource))) is None: pending.append((meta, resource)); continue
+
+            resource.links.extend(link for link in resolution['links'] if link not in resource.links)
+            if resolution['name']: resource.name = resolution['name']
+            if resolution['hash']: vars(resource.file.hash).update(resolution['hash']); resource.file.size = resolution['size']
+            if resolution['provider']: resource.providers[name] = Resource.Provider(**resolution['provider'])
+
+        self.metadata_cache.record("providers", len(batch) - len(pending), len(pending))
+        if not pending: return
+
+        if self.offline:
+            self.uncached.update((f"{resource.file.relativePath}/{resource.file.name}", resource) for _, resource in pending)
+            return
+
+        # loose Modrinth matches replace the local hashes, entries are stored under the ones asked for
+        before = {id(resource): (get_key(resource), resource.name, len(resource.links), deepcopy(resource.file.hash)) for _, resource in pending}
+        failures = self.failures[host]
+
+        await lookup(pending)
+
+        resolutions: dict[str, dict] = dict()
+
+        for _, resource in pending:
+
+            key, old_name, links_count, old_hash = before[id(resource)]
+            provider_data = resource.providers.get(name)
+            if not provider_data and self.failures[host] != failures: continue
+
+            resolutions[key] = {
+                "provider": asdict(provider_data) if provider_data else None,
+                "name": resource.name if resource.name != old_name else None,
+                "links": resource.links[links_count:],
+                "hash": asdict(resource.file.hash) if resource.file.hash != old_hash else None,
+                "size": resource.file.size
+            }
+
+        self.metadata_cache.put_resolutions(cache_name, resolutions)
+
+    async def _post_chunked(self, url: str, key: str, values: list, extract: Callable[[dict], list]) -> list:
+
+        "Splits `values` into chunks posted concurrently, a failed chunk is retried alone and dropped if it keeps failing"
+
+        async def post_chunk(chunk: list) -> list:
+            async with self.chunk_semaphore:
+                status, data = await self._request("POST", url, json={key: chunk})
+                if status != 200: return []
+                return extract(data)
+
+        futures = (post_chunk(chunk) for chunk in chunked(values, config.lookup_chunk_size))
+        return [item for items in await asyncio.gather(*futures) for item in items]
+
+    async def _get_batched_curseforge(self, batch: list[tuple[dict, Resource]]) -> None:
 
         if "CurseForge" in self.excluded_providers: return
 
-        payload = {"fingerprints":[resource.file.hash.murmur2 for _, resource in self.queue]}
-        async with self.session.post(f"{self.curseforge}/fingerprints", json=payload) as response:
-            if response.status != 200 and response.status != 504: return
-            if matches := (await response.json())['data']['exactMatches']:
-                versions = {str(version['file']['fileFingerprint']): version for version in matches}
-            else: return
-
-        payload = {"modIds": [version['id'] for version in versions.values()]}
-        async with self.session.post(f"{self.curseforge}/mods", json=payload) as response:
-            if response.status != 200 and response.status != 504: return
-            if addons_array := (await response.json())['data']:
-                addons = {addon['id']: addon for addon in addons_array}
-            else: return
-
-        for _, resource in self.queue:
+        fingerprints = [resource.file.hash.murmur2 for _, resource in batch]
+        matches = await self._post_chunked(f"{self.curseforge}/fingerprints", "fingerprints", 
+            fingerprints, lambda data: data['data']['exactMatches'])
+        if not matches: return
+        versions = {str(version['file']['fileFingerprint']): version for version in matches}
+
+        mod_ids = list({version['id'] for version in versions.values()})
+        addons_array = await self._post_chunked(f"{self.curseforge}/mods", "modIds", 
+            mod_ids, lambda data: data['data'])
+        if not addons_array: return
+        addons = {addon['id']: addon for addon in addons_array}
+
+        for _, resource in batch:
             if version := versions.get(resource.file.hash.murmur2):
                 if addon := addons.get(version['id']):
 
@@ -193,105 +469,125 @@ class ResourceAPI_Batched(ResourceAPI):
                         slug   = addon['slug'],
                         author = addon['authors'][0]['name'])
 
-    @tn.retry(stop=tn.stop.stop_after_attempt(5), wait=tn.wait.wait_fixed(1))
-    async def _get_batched_modrinth(self) -> None:
+    async def _get_batched_modrinth(self, batch: list[tuple[dict, Resource]]) -> None:
 
         if "Modrinth" in self.excluded_providers: return
         search_queue: list[tuple[dict, Resource]] = list()
 
-        payload = {"algorithm": "sha1", "hashes": [resource.file.hash.sha1 for _, resource in self.queue]}
-        async with self.session.post(f"{self.modrinth}/version_files", json=payload) as response:
-            if response.status != 200 and response.status != 504 and response.status != 423: return
-            versions = await response.json()
+        payload = {"algorithm": "sha1", "hashes": [resource.file.hash.sha1 for _, resource in batch]}
+        status, versions = await self._request("POST", f"{self.modrinth}/version_files", json=payload)
+        if status != 200: return
 
-            for meta, resource in self.queue:
-                if version := versions.get(resource.file.hash.sha1):
+        for meta, resource in batch:
+            if version := versions.get(resource.file.hash.sha1):
 
-                    file = next(file for file in version['files'] 
-                        if resource.file.hash.sha1 == file['hashes']['sha1']
-                        and resource.file.hash.sha512 == file['hashes']['sha512'])
+                file = next(file for file in version['files'] 
+                    if resource.file.hash.sha1 == file['hashes']['sha1']
+                    and resource.file.hash.sha512 == file['hashes']['sha512'])
 
-                    resource.providers['Modrinth'] = Resource.Provider(
-                    ID     = version['project_id'],
-                    fileID = version['id'],
-                    url    = file['url'],
-                    slug   = meta['id'])
-                else: search_queue.append((meta, resource))
+                resource.providers['Modrinth'] = Resource.Provider(
+                ID     = version['project_id'],
+                fileID = version['id'],
+                url    = file['url'],
+                slug   = meta['id'])
+            else: search_queue.append((meta, resource))
 
         if self.modrinth_search_type != "exact": await self._get_batched_modrinth_loose(search_queue)
 
-    @tn.retry(stop=tn.stop.stop_after_attempt(5), wait=tn.wait.wait_fixed(1))
     async def _get_batched_modrinth_loose(self, search_queue: list[tuple[dict, Resource]]) -> None:
 
-        version_ids: list[str] = list()
-        
-        @tn.retry(stop=tn.stop.stop_after_attempt(5), wait=tn.wait.wait_incrementing(1, 15, 60))
-        async def get_project_id(meta: dict, resource: Resource):
-            if self.modrinth_search_type == "loose":      
-                async with self.session.get(f"{self.modrinth}/search?query={resource.name}&limit=1") as response: 
-                    if response.status != 200 and response.status != 504 and response.status != 423: return resource, None
-                    if hits := (await response.json())['hits']: return resource, hits[0]['project_id']
-            return resource, meta['id']
-
-        futures = (get_project_id(meta, resource) for meta, resource in search_queue)
-        project_ids = {resource.name: id for resource, id in await asyncio.gather(*futures) if id}
-        if not project_ids: return
-
-        l2s = lambda l: "[{}]".format(",".join(map('"{}"'.format, l))) # list to string convesion
-        async with self.session.get(f"{self.modrinth}/projects?ids={l2s(project_ids.values())}") as response:
-            if response.status != 200 and response.status != 504 and response.status != 423: return
-            for project in (projects := await response.json()): version_ids.extend(project['versions'])
+        "Asks Modrinth only for the versions matching the pack's loader and game version, one query per project"
 
-            if not version_ids: return
+        async def get_project_id(meta: dict, resource: Resource) -> str | None:
+            if self.modrinth_search_type == "loose":      
+                status, data = await self._request("GET", f"{self.modrinth}/search?query={resource.name}&limit=1")
+                if status != 200: return None
+                if hits := data['hits']: return hits[0]['project_id']
+            return meta['id']
 
-            async with self.session.get(f"{self.modrinth}/versions?ids={l2s(version_ids)}") as response:
-                if response.status != 200 and response.status != 504 and response.status != 423: return
-                for project in projects: project['versions'] = [version for version in await response.json()
-                                                                if version['project_id'] == project['id']]
+        project_ids = await asyncio.gather(*(get_project_id(meta, resource) for meta, resource in search_queue))
+        if not any(project_ids): return
 
         minecraft_major_version = ".".join(self.intermediate.minecraft_version.split(".")[:2])
         minecraft_versions = minecraft_major_version, self.intermediate.minecraft_version
+        params = {"loaders": encode_json([self.intermediate.modloader.type]), 
+                  "game_versions": encode_json(list(dict.fromkeys(minecraft_versions)))}
 
-        for meta, resource in search_queue:
-            if project := next((project for project in projects 
-            if project['id'] == project_ids.get(resource.name, "")), None):
-                for version in project['versions']:
-                    if meta['version'] in version['version_number'] \
-                    and self.intermediate.modloader.type in version['loaders'] \
-                    and any(mv in version['game_versions'] for mv in minecraft_versions):
+        async def get_versions(project_id: str) -> tuple[str, list[dict]]:
+            status, versions = await self._request("GET", f"{self.modrinth}/project/{project_id}/version", params=params)
+            if status != 200: return project_id, []
+            return project_id, versions
 
-                        file = next(file for file in version['files'] 
-                            if file['filename'] == resource.file.name or file['primary'])
+        futures = (get_versions(project_id) for project_id in set(filter(None, project_ids)))
+        project_versions = dict(await asyncio.gather(*futures))
 
-                        resource.providers['Modrinth'] = Resource.Provider(
-                            ID     = version['project_id'],
-                            fileID = version['id'],
-                            url    = file['url'],
-                            slug   = meta['id'])
+        for (meta, resource), project_id in zip(search_queue, project_ids):
+            for version in project_versions.get(project_id) or []:
+                if meta['version'] in version['version_number']:
 
-                        resource.file.hash.sha1 = file['hashes']['sha1']
-                        resource.file.hash.sha512 = file['hashes']['sha512']
-                        resource.file.size = file['size']
+                    file = next(file for file in version['files'] 
+                        if file['filename'] == resource.file.name or file['primary'])
 
-                        break
+                    resource.providers['Modrinth'] = Resource.Provider(
+                        ID     = version['project_id'],
+                        fileID = version['id'],
+                        url    = file['url'],
+                        slug   = meta['id'])
 
-    @tn.retry(stop=tn.stop.stop_after_attempt(5), wait=tn.wait.wait_fixed(1))
-    async def _get_github_fallback(self) -> None:
+                    resource.file.hash.sha1 = file['hashes']['sha1']
+                    resource.file.hash.sha512 = file['hashes']['sha512']
+                    resource.file.size = file['size']
 
-        futures = [self._get_github(meta, resource) for meta, resource in self.queue]
+                    break
+
+    async def _get_github_fallback(self, batch: list[tuple[dict, Resource]]) -> None:
+
+        futures = [self._get_github(meta, resource) for meta, resource in batch]
         await asyncio.gather(*futures)
 
-        async with self.session.disabled():
-            async with self.session.get("https://api.github.com/rate_limit") as response:
-                ratelimit = (await response.json())['resources']['core']
-                time_remaining = datetime.fromtimestamp(float(ratelimit['reset']))
-                if ratelimit['remaining'] == 0: 
-                    print("You have exceeded the GitHub API rate-limit, only cached results will be used.")
-                    print(f"Please sign in with `mmc-export gh-login` or try again at {time_remaining:%H:%M}")
-        
+        if self.github_ratelimit_checked: return
+        self.github_ratelimit_checked = True
+
+        status, data = await self._request("GET", f"{self.github}/rate_limit", expire_after=0)
+        if status != 200: return
+
+        ratelimit = data['resources']['core']
+        time_remaining = datetime.fromtimestamp(float(ratelimit['reset']))
+        if ratelimit['remaining'] == 0: 
+            print("You have exceeded the GitHub API rate-limit, only cached results will be used.")
+            print(f"Please sign in with `mmc-export gh-login` or try again at {time_remaining:%H:%M}")
+
+
+    async def _query_github(self, cursors: list[tuple[tuple[str, str], str | None]], headers: Mapping[str, str]) -> tuple[int, dict]:
+
+        "Fetches a page of releases for every (owner, name) in one GraphQL query, repositories are aliased by their position"
 
-    @tn.retry(stop=tn.stop.stop_after_attempt(5), wait=tn.wait.wait_fixed(1))
-    async def _get_batched_github(self) -> None:
+        from gql_query_builder import GqlQuery
+        queries: list[str] = list()
+
+        for index, ((owner, name), cursor) in enumerate(cursors):
+            after = f', after: "{cursor}"' if cursor else ""
+            releases = f"""releases(first: {self.github_page_size}, orderBy: {{field: CREATED_AT, direction: DESC}}{after}) {{
+                pageInfo {{ hasNextPage endCursor }}
+                nodes {{ releaseAssets(first: {self.github_assets}) {{ nodes {{ name downloadUrl }} }} }}
+            }}"""
+            query = GqlQuery().fields([releases]) \
+                .query('repository', alias=f"r{index}", input={"name": f'"{name}"', "owner": f'"{owner}"'}) \
+                .generate()
+            queries.append(query)
+
+        payload = GqlQuery().operation(queries=queries).generate()
+        status, data = await self._request("POST", f"{self.github}/graphql", json={"query": payload}, headers=headers)
+        if status != 200 or not data: return status, dict()
+
+        # missing repositories are answers, rate-limits, node limits and timeouts come with a 200 as well
+        if data.get('data') is None or any(error.get('type') != "NOT_FOUND" for error in data.get('errors') or list()):
+            self.failures[urlparse(self.github).netloc] += 1
+
+        pages = data.get('data') or dict()
+        return status, {repo: pages.get(f"r{index}") for index, (repo, _) in enumerate(cursors)}
+
+    async def _get_batched_github(self, batch: list[tuple[dict, Resource]]) -> None:
 
         if "GitHub" in self.excluded_providers: return
 
@@ -300,13 +596,12 @@ class ResourceAPI_Batched(ResourceAPI):
         if not self.session.headers.get('Authorization'):
             if token := get_github_token(): 
                 headers['Authorization'] = f"Bearer {token}"
-            else: return await self._get_github_fallback()
+            else: return await self._get_github_fallback(batch)
 
-        Repository = namedtuple('Repository', ['name', 'owner', 'alias'])
-        repositories: list[Repository] = list()
-        pattern = re_compile(r"[\W_]+")
+        # multi-module projects share a repository, it is queried once for all of them
+        repositories: dict[tuple[str, str], list[tuple[dict, Resource]]] = dict()
 
-        for meta, resource in self.queue:
+        for meta, resource in batch:
             if "contact" not in meta: continue
             for link in meta['contact'].values():
                 parsed_link = urlparse(link)
@@ -315,63 +610,47 @@ class ResourceAPI_Batched(ResourceAPI):
 
                     path_parts = parsed_link.path[1:].split('/')
                     if len(path_parts) < 2: continue
-                    owner, name = path_parts[:2]
+                    owner, name = path_parts[0], path_parts[1].removesuffix(".git")
 
-                    alias = pattern.sub('', meta['id'])
-                    repo = Repository(name.removesuffix(".git"), owner, alias)
-                    resource.links.append(f"https://github.com/{repo.owner}/{repo.name}")
-                    repositories.append(repo)
+                    resource.links.append(f"https://github.com/{owner}/{name}")
+                    repositories.setdefault((owner, name), list()).append((meta, resource))
                     break
 
             else: continue
 
-        from gql_query_builder import GqlQuery
-        queries: list[str] = list()
-        
-        for repo in repositories:
-            query = GqlQuery().fields(['...repoReleaseAssets']) \
-                .query('repository', alias=repo.alias, input={"name": f'"{repo.name}"', "owner": f'"{repo.owner}"'}) \
-                .generate()
-            queries.append(query)
-
-        payload = """
-        fragment repoReleaseAssets on Repository {
-            releases(last: 100) { edges { node {
-                releaseAssets(last: 10) { nodes {
-                    name
-                    downloadUrl
-        } } } } } } """ + GqlQuery().operation(queries=queries).generate()
+        nodes_per_repository = self.github_page_size * (self.github_assets + 1)
+        query_size = max(config.github_query_nodes // nodes_per_repository, 1)
+        cursors: dict[tuple[str, str], str | None] = dict.fromkeys(repositories)
 
-        async with self.session.post(f"{self.github}/graphql", json={"query": payload}, headers=headers) as response:
-            if response.status == 401: delete_github_token(); raise tn.TryAgain
-            if response.status != 200 and response.status != 504: return
-            data = (await response.json()).get('data', dict())
+        for _ in range(self.github_max_pages):
 
-            if not data: return
+            if not cursors: break
 
-            for meta, resource in self.queue:
+            futures = (self._query_github(chunk, headers) for chunk in chunked(list(cursors.items()), query_size))
+            results = await asyncio.gather(*futures)
+            cursors = dict()
 
-                alias = pattern.sub('', meta['id']) if meta['id'] else "unknown"
+            if any(status == 401 for status, _ in results):
+                delete_github_token()
+                return await self._get_github_fallback([entry for entry in batch if "Other" not in entry[1].providers])
 
-                if not (repo := data.get(alias, dict())): continue
-                if not (releases := repo.get('releases', dict())): continue
-                if not (edges := releases.get('edges', list())): continue
+            for _, pages in results:
+                for repo, page in pages.items():
 
-                for release in edges:
+                    if not page or not (releases := page.get('releases')): continue
+                    assets = {asset['name']: asset['downloadUrl'] for release in releases.get('nodes') or list()
+                        for asset in (release.get('releaseAssets') or dict()).get('nodes') or list()
+                        if asset.get('name') and asset.get('downloadUrl')}
 
-                    if not (node := release.get('node', dict())): continue
-                    if not (assets := node.get('releaseAssets', dict())): continue
-                    if not (nodes := assets.get('nodes', list())): continue
-
-                    for asset in nodes:
-                        if not asset.get('name') or not asset.get('downloadUrl'): continue
-                        if asset['name'] == resource.file.name: url = asset['downloadUrl']; break
-                    else: continue
-                    break
-                else: continue
+                    for meta, resource in repositories[repo]:
+                        if "Other" in resource.providers: continue
+                        if url := assets.get(resource.file.name):
+                            resource.providers['Other'] = Resource.Provider(
+                                ID     = None,
+                                fileID = None,
+                                url    = url,
+                                slug   = meta['id'])
 
-                resource.providers['Other'] = Resource.Provider(
-                    ID     = None,
-                    fileID = None,
-                    url    = url,
-                    slug   = meta['id'])
+                    page_info = releases.get('pageInfo') or dict()
+                    if page_info.get('hasNextPage') and any("Other" not in resource.providers for _, resource in repositories[repo]):
+                        cursors[repo] = page_info.get('endCursor')
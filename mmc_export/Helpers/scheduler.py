@@ -0,0 +1,108 @@
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import datetime
+from math import inf
+from time import monotonic, time
+from typing import AsyncIterator, Mapping
+from urllib.parse import urlparse
+
+from .. import config
+
+
+class RateLimited(Exception):
+    pass
+
+
+class TokenBucket(object):
+
+    """Holds as many tokens as the provider says are left in its rate-limit window
+    and refills them all when the window resets, unknown limits are not enforced"""
+
+    def __init__(self) -> None:
+
+        self.tokens = inf
+        self.capacity = inf
+        self.window = 0.0
+        self.reset_at = monotonic()
+
+        self.lock = asyncio.Lock()
+        self.semaphore = asyncio.Semaphore(config.request_concurrency)
+
+    async def acquire(self) -> None:
+
+        async with self.lock:
+
+            if self.tokens < 1 and (delay := self.reset_at - monotonic()) > 0:
+                if delay > config.request_max_delay: raise RateLimited(delay)
+                await asyncio.sleep(delay)
+
+            if self.reset_at <= monotonic():
+                self.tokens = max(self.tokens, self.capacity)
+                self.reset_at = monotonic() + self.window
+
+            self.tokens -= 1
+
+    def release(self) -> None:
+        self.tokens += 1
+
+    def update(self, limit: int, remaining: int, reset_in: float) -> None:
+
+        # responses of earlier requests may report more than was already spent
+        if self.reset_at > monotonic() and self.tokens != inf: remaining = min(remaining, int(self.tokens))
+
+        self.tokens = remaining
+        self.capacity = limit
+        self.window = max(self.window, reset_in)
+        self.reset_at = monotonic() + max(reset_in, 0)
+
+
+class Scheduler(object):
+
+    "Every provider request goes through here, so requests are paced before the providers start to throttle them"
+
+    def __init__(self) -> None:
+        self.buckets: dict[str, TokenBucket] = dict()
+        self.exhausted: set[str] = set()
+
+    def get_bucket(self, url: str) -> tuple[str, TokenBucket]:
+
+        parsed_url = urlparse(url)
+        key = parsed_url.netloc + ("/graphql" if parsed_url.path.endswith("/graphql") else "")
+
+        if key not in self.buckets:
+            self.buckets[key] = TokenBucket()
+
+        return key, self.buckets[key]
+
+    @asynccontextmanager
+    async def slot(self, url: str) -> AsyncIterator[TokenBucket]:
+
+        key, bucket = self.get_bucket(url)
+
+        async with bucket.semaphore:
+            try: await bucket.acquire()
+            except RateLimited as error:
+                if key not in self.exhausted:
+                    self.exhausted.add(key)
+                    resumes_at = datetime.fromtimestamp(time() + error.args[0])
+                    print(f"Rate-limit for {key} is exhausted until {resumes_at:%H:%M}, skipping its requests.")
+                raise
+
+            yield bucket
+
+    @staticmethod
+    def update(bucket: TokenBucket, headers: Mapping[str, str]) -> None:
+
+        "Reads X-Ratelimit-* headers as sent by Modrinth, GitHub and CurseForge"
+
+        limit = headers.get("X-Ratelimit-Limit")
+        remaining = headers.get("X-Ratelimit-Remaining")
+        reset = headers.get("X-Ratelimit-Reset")
+        if limit is None or remaining is None or reset is None: return
+
+        try: limit, remaining, reset = int(limit), int(remaining), float(reset)
+        except ValueError: return
+
+        # GitHub sends an epoch timestamp, Modrinth the seconds left
+        reset_in = reset - time() if reset > 10**9 else reset
+        bucket.update(limit, remaining, reset_in)
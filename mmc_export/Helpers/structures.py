@@ -1,7 +1,36 @@
 from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
+from functools import lru_cache
 from pathlib import Path
 from typing import Literal
+from zipfile import Path as ZipPath
+from zipfile import ZipFile
+
+
+@lru_cache
+def open_archive(path: Path) -> ZipFile:
+    return ZipFile(path)
+
+
+class ArchivePath(ZipPath):
+
+    "Member of the instance archive, survives deepcopy and pickling by reopening the archive"
+
+    def __reduce__(self) -> tuple:
+        return ArchivePath.from_archive, (Path(self.root.filename or ""), self.at)
+
+    def __deepcopy__(self, memo: dict) -> "ArchivePath":
+        return self
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, ArchivePath) and (self.root.filename, self.at) == (other.root.filename, other.at)
+
+    def __hash__(self) -> int:
+        return hash((self.root.filename, self.at))
+
+    @staticmethod
+    def from_archive(path: Path, at: str) -> "ArchivePath":
+        return ArchivePath(open_archive(path), at)
 
 
 @dataclass
@@ -19,7 +48,7 @@ class File:
     hash: Hash = field(default_factory=Hash)
     size: int = field(default_factory=int)
 
-    path: Path = field(default_factory=Path)
+    path: Path | ArchivePath = field(default_factory=Path)
     relativePath: str = field(default_factory=str)
     disabled: bool = False
 
@@ -69,17 +98,8 @@ class Intermediate:
 
 class Format(ABC):
     def __init__(self, path: Path) -> None:
-
-        from tempfile import TemporaryDirectory
-
-        self._temp_dir = TemporaryDirectory()
-        self.temp_dir = Path(self._temp_dir.name)
-
         self.modpack_path = path
 
-    def __del__(self) -> None:
-        self._temp_dir.cleanup()
-
 
 class Writer(Format):
     def __init__(self, path: Path, intermediate: Intermediate) -> None:
@@ -1,11 +1,13 @@
-import asyncio, sys, re
+import asyncio, sys
+from os import cpu_count
 from copy import deepcopy
 import tenacity as tn
 from io import BytesIO
-from typing import Any
+from typing import IO, Any, Iterator
 from pathlib import Path
 from pprint import pformat
 from urllib.parse import urlparse
+from zipfile import ZipInfo
 
 import keyring as secret_store
 from argparse import SUPPRESS, ArgumentParser, Namespace
@@ -14,34 +16,89 @@ from aiohttp_client_cache.session import CachedSession
 from tomllib import loads as parse_toml
 
 from .. import config
-from .structures import Intermediate, Resource
+from .structures import ArchivePath, Intermediate, Resource
 
 
-def get_hash(file: Path | BytesIO | bytes, hash_type: str = "sha256") -> str:
+class Murmur2(object):
+
+    "Streaming CurseForge flavoured murmur2, whitespace is stripped on the fly"
+
+    def __init__(self) -> None:
+        self.stripped = BytesIO()
+
+    def update(self, chunk: bytes | memoryview) -> None:
+        # murmur2 is seeded with the length of the stripped data, so only the
+        # stripped stream is kept until the digest is requested
+        self.stripped.write(bytes(chunk).translate(None, b"\x09\x0A\x0D\x20"))
+
+    def hexdigest(self) -> str:
+        from murmurhash2 import murmurhash2 as murmur2
+        return str(murmur2(self.stripped.getvalue(), seed=1))
+
+def get_digest(hash_type: str) -> Any:
 
-    if isinstance(file, Path): data = file.read_bytes()
-    elif isinstance(file, BytesIO): data = file.read(); file.seek(0)
-    elif isinstance(file, bytes): data = file
-    else: raise TypeError("Incorrect file type!")
-        
     from hashlib import sha1, sha256, sha512
-    from murmurhash2 import murmurhash2 as murmur2
-    from xxhash import xxh3_64_hexdigest
+    from xxhash import xxh3_64
 
     match hash_type:
-        case "sha1": hash = sha1(data).hexdigest()
-        case "sha256": hash = sha256(data).hexdigest()
-        case "sha512": hash = sha512(data).hexdigest()
-        case "xxhash": hash = xxh3_64_hexdigest(data)
-        case "murmur2": 
-            data = re.sub(rb"[\x09\x0A\x0D\x20]", b"", data)
-            hash = str(murmur2(data, seed=1))
+        case "sha1": return sha1()
+        case "sha256": return sha256()
+        case "sha512": return sha512()
+        case "xxhash": return xxh3_64()
+        case "murmur2": return Murmur2()
         case _: raise TypeError("Incorrect hash type!")
 
-    return hash
+def iter_chunks(file: Path | ArchivePath | IO[bytes] | bytes, chunk_size: int = config.HASH_CHUNK_SIZE) -> Iterator[bytes | memoryview]:
+
+    if isinstance(file, Path | ArchivePath):
+        with file.open("rb") as stream:
+            while chunk := stream.read(chunk_size): yield chunk
+    elif isinstance(file, bytes):
+        view = memoryview(file)
+        for offset in range(0, len(view), chunk_size):
+            yield view[offset:offset + chunk_size]
+    elif hasattr(file, "read"):
+        while chunk := file.read(chunk_size): yield chunk
+        file.seek(0)
+    else: raise TypeError("Incorrect file type!")
+
+def get_hashes(file: Path | ArchivePath | IO[bytes] | bytes, *args: str) -> list[str]:
+
+    "Reads the file once and feeds every requested digest with the same chunks"
+
+    digests = [get_digest(hash_type) for hash_type in args]
+
+    for chunk in iter_chunks(file):
+        for digest in digests: digest.update(chunk)
+
+    return [digest.hexdigest() for digest in digests]
+
+def get_hash(file: Path | ArchivePath | IO[bytes] | bytes, hash_type: str = "sha256") -> str:
+    return get_hashes(file, hash_type)[0]
+
+def copy_file(source: Path | ArchivePath, destination: Path) -> None:
+
+    "Copies a file or streams an archive member to `destination`, which must be a file path"
 
-def get_hashes(file: Path | BytesIO | bytes, *args: str):
-    return [get_hash(file, hash_type) for hash_type in args]
+    if isinstance(source, Path): 
+        from shutil import copy2
+        copy2(source, destination)
+    else:
+        from shutil import copyfileobj
+        with source.open("rb") as src, open(destination, "wb") as dst:
+            copyfileobj(src, dst, config.HASH_CHUNK_SIZE)
+
+def chunked(items: list, size: int) -> Iterator[list]:
+    for offset in range(0, len(items), size):
+        yield items[offset:offset + size]
+
+def get_stat_key(info: ZipInfo) -> tuple[str, int, int, int]:
+
+    """Archive members have no inode, their CRC-32 from the central directory stands in for it.
+    The DOS timestamp is packed as it is, zeroed dates are valid in zip files but aren't dates"""
+
+    mtime = int("".join(f"{field:02}" for field in info.date_time))
+    return info.filename, info.file_size, mtime, info.CRC
 
 async def add_github_token() -> None:
 
@@ -102,8 +159,18 @@ def parse_args() -> Namespace:
     arg_parser.add_argument('--exclude-providers', dest='excluded_providers', type=str, nargs="+", choices=providers, default=[])
     arg_parser.add_argument('--provider-priority', dest="providers_priority", type=str, nargs="+", choices=providers)
     arg_parser.add_argument('--skip-cache', dest='skip_cache', action='store_true')
+    arg_parser.add_argument('--offline', dest='offline', action='store_true')
+    arg_parser.add_argument('--strict', dest='strict', action='store_true')
     arg_parser.add_argument('-v', '--version', dest='modpack_version', type=str)
     arg_parser.add_argument('--scheme', dest='scheme', type=str)
+    arg_parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=cpu_count() or 1)
+    arg_parser.add_argument('--cache-max-size', dest='cache_max_size', type=int)
+    arg_parser.add_argument('--cache-max-age', dest='cache_max_age', type=int)
+    arg_parser.add_argument('--web-cache', dest='web_cache', type=str, choices=('sqlite', 'redis', 'filesystem'))
+    arg_parser.add_argument('--web-cache-location', dest='web_cache_location', type=str)
+    arg_parser.add_argument('--compression-level', dest='compression_level', type=int, choices=range(10))
+    arg_parser.add_argument('--compression-threads', dest='compression_threads', type=int)
+    arg_parser.add_argument('--packwiz-dir', dest='packwiz_directory', type=Path)
 
     arg_subs = arg_parser.add_subparsers(dest='cmd')
     arg_subs.add_parser('gh-login', add_help=False)
@@ -113,6 +180,7 @@ def parse_args() -> Namespace:
     arg_cache.add_argument('--web', dest='cache_web', action='store_true')
     arg_cache.add_argument('--files', dest='cache_files', action='store_true')
     arg_cache.add_argument('--all', dest='cache_all', action='store_true')
+    arg_subs.add_parser('cache-stats', add_help=False)
     
     args = arg_parser.parse_args(args=None if sys.argv[1:] else ['--help'])
 
@@ -142,6 +210,18 @@ def parse_args() -> Namespace:
             print("Default priority will be used for this run.")
         else: config.providers_priority = tuple(priority)
 
+    if args.cache_max_size is not None: config.cache_max_size = args.cache_max_size * 1024**2
+    if args.cache_max_age is not None: config.cache_max_age = args.cache_max_age * 24 * 60 * 60
+    if args.web_cache: config.web_cache_backend = args.web_cache
+    if args.compression_level is not None: config.compression_level = args.compression_level
+    if args.compression_threads is not None: config.compression_threads = args.compression_threads
+    if args.web_cache_location: config.web_cache_location = args.web_cache_location
+    if args.packwiz_directory: config.packwiz_directory = args.packwiz_directory
+
+    if config.web_cache_backend == "redis":
+        from importlib.util import find_spec
+        if not find_spec("redis"): arg_parser.error("Redis web cache requires the redis package!")
+
     if args.cmd and args.cmd == "purge-cache":
         if not args.cache_web \
             or not args.cache_files \
@@ -152,6 +232,12 @@ def parse_args() -> Namespace:
         if not args.input: arg_parser.error("Input must be specified!")
         if not args.formats: arg_parser.error("At least one format must be specified!")
         if not args.input.exists(): arg_parser.error("Invalid input!")
+        if args.jobs < 1: arg_parser.error("Jobs count must be positive!")
+        if config.compression_threads < 1: arg_parser.error("Compression threads count must be positive!")
+        if args.offline and args.skip_cache: arg_parser.error("Offline mode needs the cache!")
+        if args.strict and not args.offline: arg_parser.error("Strict mode works only offline!")
+        if args.packwiz_directory and "packwiz" not in args.formats: arg_parser.error("Packwiz directory needs the packwiz format!")
+        if args.packwiz_directory and not args.packwiz_directory.is_dir(): arg_parser.error("Packwiz directory must exist!")
 
     return args
 
@@ -222,23 +308,57 @@ def parse_config(cfg_path: Path, intermediate: Intermediate) -> Intermediate:
 
     return _intermediate
         
-async def resolve_conflicts(session: CachedSession, intermediate: Intermediate) -> Intermediate: 
+async def resolve_conflicts(session: CachedSession, intermediate: Intermediate, offline: bool = False) -> Intermediate: 
+
+    "Verifies files of the 'Other' provider, downloads are hashed while they are streamed into the blob store"
+
+    from .cache import BlobStore, MetadataCache
 
     _intermediate = deepcopy(intermediate)
 
-    @tn.retry(stop=tn.stop.stop_after_attempt(5), wait=tn.wait.wait_fixed(1))
-    async def download_file(url: str) -> tuple[str, bytes]:
-        async with session.get(url) as response:
-            return url, await response.read()
+    blob_store = BlobStore()
+    metadata_cache = MetadataCache()
+    semaphore = asyncio.Semaphore(config.download_concurrency)
+
+    urls = {provider.url for resource in _intermediate.resources if (provider := resource.providers.get('Other'))}
+    downloads = {url: fields for url, fields in metadata_cache.get_downloads(urls).items() if blob_store.contains(fields[2])}
+    for fields in downloads.values(): blob_store.touch(fields[2])
+
+    async def download_file(url: str) -> None:
+
+        retrying = tn.AsyncRetrying(stop=tn.stop.stop_after_attempt(5), wait=tn.wait.wait_fixed(1))
+
+        async with semaphore:
+            try:
+                async for attempt in retrying:
+                    with attempt, blob_store.create() as file:
+
+                        digests = [get_digest(hash_type) for hash_type in ("sha1", "sha256", "sha512")]
+                        async with session.get(url, expire_after=0) as response: # type: ignore
+                            response.raise_for_status()
+                            async for chunk in response.content.iter_chunked(config.HASH_CHUNK_SIZE):
+                                file.write(chunk)
+                                for digest in digests: digest.update(chunk)
+
+                        sha1, sha256, sha512 = [digest.hexdigest() for digest in digests]
+                        size = file.tell()
+                        blob_store.commit(file, sha512)
+                        downloads[url] = sha1, sha256, sha512, size
+
+            except tn.RetryError as error: print(f"Download of {url} failed: {error.last_attempt.exception()}")
+
+    # files missing from the blob store are left unverified offline
+    if not offline: 
+        pending = urls - downloads.keys()
+        await asyncio.gather(*(download_file(url) for url in pending))
+        metadata_cache.put_downloads({url: downloads[url] for url in pending if url in downloads})
 
-    futures = [download_file(r.providers['Other'].url) for r 
-        in _intermediate.resources if "Other" in r.providers]
-    files = await asyncio.gather(*futures)
+    metadata_cache.close()
 
     for resource in _intermediate.resources:
         if provider := resource.providers.get('Other'):
-            cloud_file = next(file for url, file in files if url == provider.url)
-            sha1, sha256, sha512 = get_hashes(cloud_file, "sha1", "sha256", "sha512")
+            if not (download := downloads.get(provider.url)): continue
+            sha1, sha256, sha512, size = download
             if "Modrinth" in resource.providers:
                 if resource.file.hash.sha1 != sha1 or resource.file.hash.sha512 != sha512:
                     resource.providers.pop("Other")
@@ -246,7 +366,7 @@ async def resolve_conflicts(session: CachedSession, intermediate: Intermediate)
                 resource.file.hash.sha1 = sha1
                 resource.file.hash.sha256 = sha256 
                 resource.file.hash.sha512 = sha512 
-                resource.file.size = len(cloud_file)
+                resource.file.size = size
 
     return _intermediate
 
@@ -269,5 +389,7 @@ class JsonEncoder(json.JSONEncoder):
             return self.clean(data)
         if isinstance(o, Path):
             return o.as_posix()
+        if isinstance(o, ArchivePath):
+            return str(o)
 
         return super().default(o)
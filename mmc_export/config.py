@@ -10,6 +10,25 @@ OAUTH_GITHUB_CLIENT_ID = "8011f22f502b091464de"
 
 CACHE_HOME = environ.get("XDG_CACHE_HOME", Path().home() / ".cache")
 DEFAULT_CACHE_DIR = Path(CACHE_HOME) / "mmc-export"
+HASH_CHUNK_SIZE = 1024 * 1024
+SPOOL_MAX_SIZE = 64 * 1024 * 1024
 
 output_naming_scheme = "{abbr}_{name}"
-providers_priority = ("CurseForge", "Modrinth", "Other")
\ No newline at end of file
+providers_priority = ("CurseForge", "Modrinth", "Other")
+cache_max_size = 1024 * 1024**2 # bytes, applied to every cache separately
+cache_max_age = 30 * 24 * 60 * 60 # seconds since the entry was last used
+lookup_chunk_size = 500 # items per CurseForge lookup request
+lookup_concurrency = 4 # chunked lookup requests in flight at once
+request_concurrency = 8 # provider requests in flight per host
+request_max_delay = 5 * 60 # seconds a request may wait for its rate-limit window, minute windows (Modrinth, CurseForge) are waited out, hourly ones (GitHub) skipped
+resolution_ttl = 30 * 24 * 60 * 60 # seconds a resolved provider is trusted
+negative_resolution_ttl = 24 * 60 * 60 # seconds a "not found" answer is trusted
+github_query_nodes = 50_000 # nodes a single GitHub GraphQL query may ask for, GitHub rejects queries above 500 000
+download_concurrency = 8 # files downloaded at once to verify "Other" providers
+web_cache_backend = "sqlite" # one of sqlite, redis or filesystem
+web_cache_location: str | None = None # database file, redis url or directory, by default next to the cache dir, on localhost or in a temp dir
+compression_level = 6 # deflate level of entries that aren't compressed already, 0 stores everything
+compression_threads = 1 # threads deflating a single large entry
+parallel_compression_size = 16 * 1024 * 1024 # entries at least this large are deflated by several threads
+stored_suffixes = (".jar", ".zip", ".mrpack", ".png", ".jpg", ".jpeg", ".ogg", ".gz", ".xz", ".7z") # already compressed, stored as they are
+packwiz_directory: Path | None = None # existing packwiz directory updated in place instead of writing a zip
@@ -1,13 +1,16 @@
+import asyncio
 from importlib import import_module
 from json import dump as write_json
 from shutil import rmtree
 
 import ssl, certifi
 from aiohttp import TCPConnector
-from aiohttp_client_cache.backends.filesystem import FileBackend
-from aiohttp_client_cache.session import CachedSession
 
+from .Helpers.archive import ArchiveWriter, EntryStore
+from .Helpers.cache import (CachedSession, collect_garbage, get_web_cache,
+                            print_cache_stats)
 from .Helpers.resourceAPI import ResourceAPI
+from .Helpers.structures import Writer
 from .Helpers.utils import (JsonEncoder, add_github_token, parse_args,
                             parse_config, resolve_conflicts)
 from .parser import Parser
@@ -20,9 +23,12 @@ async def program():
 
     ResourceAPI.modrinth_search_type = args.modrinth_search
     ResourceAPI.excluded_providers = args.excluded_providers
+    ResourceAPI.jobs = args.jobs
+    ResourceAPI.offline = args.offline
+    ResourceAPI.formats = args.formats
 
     ssl_context = ssl.create_default_context(cafile=certifi.where())
-    cache = FileBackend("mmc-export", use_temp=True, urls_expire_after={'*.jar': -1}, allowed_methods=("GET", "POST", "HEAD"))
+    cache = get_web_cache()
     async with CachedSession(cache=cache, connector=TCPConnector(limit=0, ssl_context=ssl_context)) as session: 
         if args.skip_cache: session.cache.disabled = True # type: ignore
 
@@ -35,13 +41,22 @@ async def program():
                 if args.cache_web or args.cache_all: await session.cache.clear() # type: ignore
                 if args.cache_files or args.cache_all: rmtree(config.DEFAULT_CACHE_DIR, ignore_errors=True)
                 return
+            case "cache-stats": await print_cache_stats(session); return
 
         parser = Parser(args.input, session) # type: ignore
         intermediate = await parser.parse()
+
+        if args.strict and (uncached := parser.resourceAPI.uncached):
+            print("Following resources aren't cached, can't export offline:")
+            for path in sorted(uncached): print(f"  {path}")
+            return 1
         
         if version := args.modpack_version: intermediate.version = version
         intermediate = parse_config(args.config, intermediate)
-        intermediate = await resolve_conflicts(session, intermediate) # type: ignore
+        intermediate = await resolve_conflicts(session, intermediate, args.offline) # type: ignore
+
+        writers: list[Writer] = list()
+        archives = 0
 
         for format in args.formats:
 
@@ -51,10 +66,18 @@ async def program():
                 continue
 
             module = import_module(f".Formats.{format.lower()}", "mmc_export")
-            Writer = getattr(module, format)
+            writers.append(getattr(module, format)(args.output, intermediate))
+            if format != "packwiz" or not config.packwiz_directory: archives += 1
+
+        # overrides are compressed once and copied into every archive, a packwiz directory isn't one
+        if archives > 1: ArchiveWriter.entries = EntryStore()
+
+        await asyncio.gather(*(asyncio.to_thread(writer.write) for writer in writers))
+
+        if ArchiveWriter.entries: ArchiveWriter.entries.close()
 
-            writer = Writer(args.output, intermediate)
-            writer.write()         
+        # stale entries are all an offline run has, so they are kept
+        if not args.offline: await collect_garbage(session)
 
     return 0
 
@@ -64,6 +87,6 @@ def main():
         policy = asyncio.WindowsSelectorEventLoopPolicy()  # type: ignore
         asyncio.set_event_loop_policy(policy)
                 
-    try: asyncio.run(program())
+    try: sys.exit(asyncio.run(program()))
     except KeyboardInterrupt: 
         print("Operation aborted by user.")
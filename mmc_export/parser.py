@@ -1,12 +1,15 @@
+import asyncio
 from configparser import ConfigParser
 from json import loads as parse_json
-from pathlib import Path
+from os import DirEntry, scandir
+from pathlib import Path, PurePosixPath
+from typing import Iterator
 
 from aiohttp_client_cache.session import CachedSession
 
 from .Helpers.resourceAPI import ResourceAPI_Batched
-from .Helpers.structures import File, Format, Intermediate
-from .Helpers.utils import get_hash
+from .Helpers.structures import ArchivePath, File, Format, Intermediate, open_archive
+from .Helpers.utils import get_hash, get_stat_key
 
 
 class Parser(Format):
@@ -20,14 +23,14 @@ class Parser(Format):
 
     def get_basic_info(self) -> None:
 
-        data = next(self.temp_dir.glob("**/instance.cfg")).read_text()
+        data = next(file for file in self.files if file.name == "instance.cfg").read_text()
 
         cfg = ConfigParser()
         cfg.read_string("[dummy_section]\n" + data)
         if name := cfg['dummy_section'].get('name'):
             self.intermediate.name = name
 
-        bdata = next(self.temp_dir.glob("**/mmc-pack.json")).read_bytes()
+        bdata = next(file for file in self.files if file.name == "mmc-pack.json").read_bytes()
         pack_info = parse_json(bdata)        
 
         for component in pack_info['components']:
@@ -46,14 +49,39 @@ class Parser(Format):
                     self.intermediate.modloader.type = "forge"
                     self.intermediate.modloader.version = version
 
-    def get_override(self, path: Path) -> None:
+    def scan_directory(self, directory: Path) -> Iterator[DirEntry]:
+        with scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False): yield from self.scan_directory(Path(entry.path))
+                elif entry.is_file(): yield entry
 
-        for n, part in enumerate(path.parts):
+    def get_files(self) -> dict[Path | ArchivePath, tuple]:
+
+        "Lists every file of the instance once, keyed by its stat key"
+
+        if self.modpack_path.is_dir():
+            files: dict[Path | ArchivePath, tuple] = dict()
+            for entry in self.scan_directory(self.modpack_path):
+                path, stat = Path(entry.path), entry.stat()
+                relative_path = path.relative_to(self.modpack_path).as_posix()
+                files[path] = relative_path, stat.st_size, stat.st_mtime_ns, stat.st_ino
+            return files
+
+        # members are read straight from the archive, nothing is extracted
+        archive = open_archive(self.modpack_path)
+        return {ArchivePath(archive, info.filename): get_stat_key(info) 
+            for info in archive.infolist() if not info.is_dir()}
+
+    def get_override(self, path: Path | ArchivePath, relative_path: PurePosixPath) -> None:
+
+        parts = relative_path.parts
+
+        for n, part in enumerate(parts):
             if part in ("minecraft", ".minecraft"):
                 root_dir_id = n; break
         else: return
         
-        relative_path = path.relative_to(*path.parts[:root_dir_id + 1]).parent
+        relative_path = PurePosixPath(*parts[root_dir_id + 1:]).parent
 
         file = File(
             name = path.name,
@@ -67,20 +95,21 @@ class Parser(Format):
         
         downloadable_content = ("resourcepacks", "shaderpacks", "mods")
 
-        from shutil import unpack_archive        
-        unpack_archive(self.modpack_path, self.temp_dir)
+        stat_keys = self.get_files()
+        self.files = list(stat_keys)
         self.get_basic_info()
 
-        overrides = list()
+        resources, overrides = list(), list()
 
-        for file in [file for file in self.temp_dir.glob("**/*") if file.is_file()]:
+        for file in self.files:
             if file.parent.name in downloadable_content and file.suffix != ".txt": 
-                self.resourceAPI.queue_resource(file)
+                resources.append(file)
             else: overrides.append(file)
 
-        self.intermediate.resources = await self.resourceAPI.gather()
+        producer = self.resourceAPI.queue_resources(resources, stat_keys)
+        _, self.intermediate.resources = await asyncio.gather(producer, self.resourceAPI.gather())
 
         for override in overrides:
-            self.get_override(override)
+            self.get_override(override, PurePosixPath(stat_keys[override][0]))
 
         return self.intermediate